@@ -1,5 +1,5 @@
+import sys
 import numpy as np
-import math
 
 _CITIES = (("Bordeaux", (44.833333,-0.566667)), ("Paris",(48.8566969,2.3514616)),("Nice",(43.7009358,7.2683912)),
 ("Lyon",(45.7578137,4.8320114)),("Nantes",(47.2186371,-1.5541362)),("Brest",(48.4,-4.483333)),("Lille",(50.633333,3.066667)),
@@ -14,184 +14,436 @@ Q = 100
 NB_ANTS = 100
 NB_RUNS = 100
 p = 0.9
+# Ant Colony System choice: probability for an ant to exploit the most attractive edge rather than explore
+q0 = 0.9
+# Number of nearest cities in the candidate list of every city
+NB_CANDIDATES = 20
 
-# Distance between 2 points
-def distance(a,b):
-    (x1,y1),(x2,y2) = (a,b)
-    return np.sqrt((x1-x2)**2+(y1-y2)**2) 
+# Distances between the points of ids a and b (arrays of ids, broadcast together)
+def distances(coords, a, b):
+    return np.hypot(coords[a, 0] - coords[b, 0], coords[a, 1] - coords[b, 1])
 
+# Heuristic part of the attractiveness of every edge, (1 / distance)^beta, 0 from a city to itself
+def heuristic(distances, beta):
+    eta = np.zeros(distances.shape)
+    np.divide(1., distances ** beta, out=eta, where=distances > 0)
+    return eta
 
-# Data structure for pheromons
+# Candidate lists: ids of the k nearest points of every point, nearest first, (n, k). The points are bucketed
+# in square cells holding about k points each, and the neighbours of a point are looked for in its cell and
+# the cells around it. They are exact when the k-th one is closer than the side of a cell, otherwise (sparse
+# regions) the point is compared to all the others.
+def candidates(coords, k):
+    n = len(coords)
+    k = min(k, n - 1)
+    side = max(1, int(np.sqrt(n / max(k, 1))))
+    low = coords.min(axis=0)
+    size = max((coords.max(axis=0) - low).max() / side, np.finfo(float).tiny)
+
+    # Points sorted by cell (cells numbered row by row), bounds[c] being the first point of the cell c
+    cells = np.minimum(((coords - low) / size).astype(int), side - 1)
+    ids = cells[:, 0] * side + cells[:, 1]
+    order = np.argsort(ids, kind='stable')
+    bounds = np.searchsorted(ids[order], np.arange(side * side + 1))
+
+    nearest = np.empty((n, k), dtype=int)
+    for cell in np.unique(ids):
+        x, y = divmod(cell, side)
+        points = order[bounds[cell]:bounds[cell + 1]]
+
+        # Points of the 3 x 3 cells around the cell, contiguous along each row of cells
+        block = np.concatenate([order[bounds[i * side + max(y - 1, 0)]:bounds[i * side + min(y + 1, side - 1) + 1]]
+                                for i in range(max(x - 1, 0), min(x + 1, side - 1) + 1)])
+        if len(block) <= k:
+            block = np.arange(n)
+        lengths = distances(coords, points[:, None], block[None, :])
+        lengths[points[:, None] == block[None, :]] = np.inf
+        closest = np.argpartition(lengths, k - 1, axis=1)[:, :k]
+        closest = np.take_along_axis(closest, np.argsort(np.take_along_axis(lengths, closest, axis=1), axis=1), axis=1)
+        nearest[points] = block[closest]
+
+        # Points whose k-th neighbour may be out of the block
+        far = distances(coords, points, block[closest[:, -1]]) > size
+        for point in points[far]:
+            lengths = distances(coords, point, np.arange(n))
+            lengths[point] = np.inf
+            closest = np.argpartition(lengths, k - 1)[:k]
+            nearest[point] = closest[np.argsort(lengths[closest])]
+
+    return nearest
+
+# Random cities in a 100 x 100 square
+def random_cities(n):
+    return np.random.random((n, 2)) * 100
+
+# Sets the cities to visit, identified by their index in coords: their candidate lists and the heuristic
+# of the edges to their candidates
+def load(coords, names = None, k = NB_CANDIDATES):
+    global _NAMES, _COORDS, _CANDIDATES, _HEURISTIC
+    _COORDS = np.asarray(coords, dtype=float)
+    _NAMES = list(names) if names is not None else [f"City {i}" for i in range(len(_COORDS))]
+    _CANDIDATES = candidates(_COORDS, k)
+    _HEURISTIC = heuristic(distances(_COORDS, np.arange(len(_COORDS))[:, None], _CANDIDATES), beta)
+
+load([city[1] for city in _CITIES], [city[0] for city in _CITIES])
+
+
+# Positions of the given ids in a sorted array of ids, and mask of the ids found in it
+def find(keys, ids):
+    if len(keys) == 0:
+        return np.zeros(np.shape(ids), dtype=bool), np.zeros(np.shape(ids), dtype=int)
+    slots = np.minimum(np.searchsorted(keys, ids), len(keys) - 1)
+    return keys[slots] == ids, slots
+
+# Data structure for pheromons, pheromons[i, j] on the edge from i to j (arrays of ids, broadcast together).
+# The edges from every city to its candidates are held in a (n, k) matrix aligned with _CANDIDATES, the other
+# edges used by the ants in a map (sorted edge ids and their values), the edges never used keeping the initial
+# value. Evaporation only scales all of them by a common factor, the values being stored divided by it.
 class Pheromons():
     
-    _edges = None
+    _n = None
+    _candidates = None  # Edges to the candidates, (n, k)
+    _keys = None        # Edges to the candidates as flat ids (i * n + j), sorted
+    _slots = None       # Position in _candidates (flat) of every edge of _keys
+    _other_keys = None  # Other edges used by the ants as flat ids, sorted
+    _other_values = None
+    _default = None     # Edges never used
+    _scale = None       # Common factor of all the stored values
     _p = None
+    _choice = None
+    
+    # Below this scale, it is applied to the stored values before it underflows
+    SCALE_MIN = 1e-100
     
-    def __init__(self, p = 0.9):
+    def __init__(self, p = 0.9, n = None):
         
-        self._edges = {}
+        if n is None:
+            n = len(_COORDS)
+        self._n = n
         self._p = p
         
-        for city in _CITIES:
-            
-            self._edges[city[0]] = {}
-            
-            for city_bis in _CITIES:
-                
-                if(city != city_bis):
-  
-                    self._edges[city[0]][city_bis[0]] = 1
-    
-        #print(self._edges)
+        # 1 on every edge between two different cities
+        self._candidates = np.ones(_CANDIDATES.shape)
+        keys = (np.arange(n)[:, None] * n + _CANDIDATES).ravel()
+        self._slots = np.argsort(keys)
+        self._keys = keys[self._slots]
+        self._other_keys = np.zeros(0, dtype=keys.dtype)
+        self._other_values = np.zeros(0)
+        self._default = 1.
+        self._scale = 1.
+        self.updateChoiceInfo()
         
     # Method for pheromon evaporation after each loop
     def evaporate(self):
-        for key, value in self._edges.items():
-            for city in value:
-                value[city] = value[city] * self._p
-    
+        self._scale *= self._p
+        if self._scale < self.SCALE_MIN:
+            self._candidates *= self._scale
+            self._other_values *= self._scale
+            self._default *= self._scale
+            self._scale = 1.
+
+    # Choice info: attractiveness gamma + tau^alpha * eta^beta of the edges from every city to its candidates,
+    # computed once per loop (after evaporation and deposit) and read by all the ants of the next loop
+    def updateChoiceInfo(self):
+        self._choice = gamma + (self._candidates * self._scale) ** alpha * _HEURISTIC
+
+    # Attractiveness of the edges from cities to their candidates (the columns of _CANDIDATES)
+    def choiceInfo(self, city):
+        return self._choice[city]
+
+    # Attractiveness of the edges from cities to the given cities (every city by default), computed on demand
+    def fullChoiceInfo(self, city, to = None):
+        if to is None:
+            to = np.arange(self._n)
+        city = np.asarray(city)[..., None]
+        return gamma + self[city, to] ** alpha * heuristic(distances(_COORDS, city, to), beta)
+
+    def __len__(self):
+        return self._n
 
     def __getitem__(self, key):
-        return self._edges[key]
+        rows, cols = np.broadcast_arrays(*key)
+        ids = rows * self._n + cols
+        values = np.full(ids.shape, self._default)
+
+        found, slots = find(self._keys, ids)
+        values[found] = self._candidates.ravel()[self._slots[slots[found]]]
+        other, slots = find(self._other_keys, ids)
+        values[other] = self._other_values[slots[other]]
+        values[rows == cols] = 0
+        return values * self._scale
 
+    # Sets the given edges (the last value of an edge given twice)
     def __setitem__(self, key, value):
-        self._edges[key] = value
+        rows, cols, value = (a.ravel() for a in np.broadcast_arrays(*key, value))
+        ids, last = np.unique((rows * self._n + cols)[::-1], return_index=True)
+        values = value[::-1][last] / self._scale
+
+        found, slots = find(self._keys, ids)
+        self._candidates.ravel()[self._slots[slots[found]]] = values[found]
+        ids, values = ids[~found], values[~found]
+
+        # Edges already in the map are updated, the others inserted in it
+        other, slots = find(self._other_keys, ids)
+        self._other_values[slots[other]] = values[other]
+        at = np.searchsorted(self._other_keys, ids[~other])
+        self._other_keys = np.insert(self._other_keys, at, ids[~other])
+        self._other_values = np.insert(self._other_values, at, values[~other])
         
         
     def __repr__(self):
-        return self._edges.__repr__()
+        return (self._candidates * self._scale).__repr__()
+
+# Next city of every ant given the choice info rows of their current cities and the masks of the cities
+# they have seen. As in the Ant Colony System, an ant exploits with probability q0: it goes to the unseen city
+# with the most attractive edge (probabilities share the same denominator). Otherwise it explores: it draws an
+# unseen city with the probability of computeProb, on a roulette wheel (cumulative sum of the attractiveness
+# of the unseen cities, then a binary search of a uniform draw).
+def choose(rows, visited):
+    masked = np.where(visited, 0, rows)
+    cities = np.argmax(masked, axis=1)
+
+    explore = np.flatnonzero(np.random.random(len(rows)) >= q0)
+    if len(explore):
+        n = rows.shape[1]
+        # Wheels of the exploring ants laid end to end, scaled so that the wheel k spans [2k, 2k + 1],
+        # and searched all at once
+        offsets = 2 * np.arange(len(explore))
+        wheels = np.cumsum(masked[explore], axis=1)
+        wheels = wheels / wheels[:, -1:] + offsets[:, None]
+        draws = offsets + np.random.random(len(explore))
+        drawn = np.searchsorted(wheels.ravel(), draws, side='right') - n * np.arange(len(explore))
+
+        # A draw rounded up to the end of its wheel falls past the last city, the ant then exploits
+        drawn = np.minimum(drawn, n - 1)
+        cities[explore] = np.where(visited[explore, drawn], cities[explore], drawn)
+
+    return cities
+
+# Next city of ants at the given cities, given the masks of the cities they have seen: chosen among the
+# unseen candidates of their city, or among all the unseen cities once every candidate has been seen
+def move(pheromons, cities, visited):
+    ants = np.arange(len(cities))[:, None]
+
+    candidates = _CANDIDATES[cities]
+    seen = visited[ants, candidates]
+    full = seen.all(axis=1)
+
+    next_cities = np.empty_like(cities)
+    some = ~full
+    picks = choose(pheromons.choiceInfo(cities[some]), seen[some])
+    next_cities[some] = np.take_along_axis(candidates[some], picks[:, None], axis=1)[:, 0]
+    if full.any():
+        # Only the cities still unseen by one of these ants are scanned
+        unseen = np.flatnonzero(~visited[full].all(axis=0))
+        next_cities[full] = unseen[choose(pheromons.fullChoiceInfo(cities[full], unseen), visited[full][:, unseen])]
+    return next_cities
 
 # Class for one autonomous ant
 class Ant():
     
-    _city = None             # Current city
-    _path = None             # Path so far
+    _city = None             # Current city (id)
+    _path = None             # Path so far (ids)
     _distance = None         # Total length of the journey
     _done = None             # State of the journey
-    _remaining_cities = None # Unseen cities
+    _visited = None          # Seen cities (mask over the ids)
     _history = None
+    _pheromons = None        # Pheromons read and dropped by the ant
     
-    def __init__(self):
+    def __init__(self, pheromons):
+        
+        self._pheromons = pheromons
         
         # Start in a random city
-        index = np.random.randint(0, len(_CITIES))
-        self._city = _CITIES[index]
+        self._city = np.random.randint(0, len(_COORDS))
         self._path = [self._city]
-        self._remaining_cities = [city for city in _CITIES if city != self._city]
+        self._visited = np.zeros(len(_COORDS), dtype=bool)
+        self._visited[self._city] = True
 
         self._done = False
         self._distance = 0
         self._history = []
         #print(f"Ant starting at {self._city[0]}")
     
-    # Compute probability for ant to move to city in the next step
+    # Compute probability for ant to move to city in the next step when it explores
     def computeProb(self, city):
-        global pheromons
         
-        prob1 = gamma + pheromons[self._city[0]][city[0]]**alpha * 1./distance(self._city[1], city[1])**beta
-        prob2 = 0
-
-        for c in self._remaining_cities:
-                prob2 += (gamma + pheromons[self._city[0]][c[0]]**alpha * 1./distance(self._city[1], c[1])**beta)
-
-        return prob1 / prob2
+        # Among the unseen candidates, or among all the unseen cities once every candidate has been seen
+        candidates = _CANDIDATES[self._city]
+        unseen = ~self._visited[candidates]
+        if unseen.any():
+            row = self._pheromons.choiceInfo(self._city)
+            return row[unseen & (candidates == city)].sum() / row[unseen].sum()
+        
+        row = self._pheromons.fullChoiceInfo(self._city)
+        return row[city] * (not self._visited[city]) / row[~self._visited].sum()
 
     # One step forward in the journey, pick the next destination city
     def nextCity(self):
         
         # Case we went once to every city, end of the loop
-        if len(self._path) == len(_CITIES):
+        if len(self._path) == len(_COORDS):
             start = self._path[0]
             self._path.append(start)
             self._done = True
-            self._distance += distance(self._city[1], start[1])
+            self._distance += distances(_COORDS, self._city, start)
             self._city = start
             #self.displayPath()
             return
 
-        # Max probability
-        pmax = 0
-        
-        # Compute next destination according to probabilities
-        for city in self._remaining_cities:
-                prob = self.computeProb(city)
-                if prob > pmax:
-                    pmax = prob
-                    next_city = city 
+        # Next destination, among the candidates of the city first
+        next_city = move(self._pheromons, np.array([self._city]), self._visited[None])[0]
 
         # Move to the next city
-        self._distance += distance(self._city[1], next_city[1])
+        self._distance += distances(_COORDS, self._city, next_city)
         self._city = next_city
         self._path.append(next_city)
-        self._remaining_cities.remove(next_city)
+        self._visited[next_city] = True
         
         
     # Update pheromons structure according to the path length
     def dropPheromons(self):
-        global pheromons
         
         # Quantity of pheromons to drop
         value = Q / self._distance
         
-        for i in range(len(self._path) - 1):
-                pheromons[self._path[i][0]][self._path[i+1][0]] = value
-                pheromons[self._path[i+1][0]][self._path[i][0]] = value
+        # Both directions of every edge of the path
+        path = np.array(self._path)
+        self._pheromons[path[:-1], path[1:]] = value
+        self._pheromons[path[1:], path[:-1]] = value
         
     # Display function for the path found by the ant
     def displayPath(self):
         
         toret = ""
         for city in self._path:
-            toret += city[0] + " - "
+            toret += _NAMES[city] + " - "
             
         toret += "(" + str(self._distance) + ")"
         print(toret)
     
     # Reset ant after she did her job (i.e. loop and drop pheromons)
     def reset(self):
-        index = np.random.randint(0, len(_CITIES))
-        self._city = _CITIES[index]
+        self._city = np.random.randint(0, len(_COORDS))
         self._path = [self._city]
-        self._remaining_cities = [city for city in _CITIES if city != self._city]
+        self._visited = np.zeros(len(_COORDS), dtype=bool)
+        self._visited[self._city] = True
         self._done = False
         self._history.append(self._distance)
         self._distance = 0
     
-    # One run for the ant
+    # One run for the ant: the journey only, pheromons are dropped once all the ants are done
     def run(self):
         
         while not self._done:
             self.nextCity()
-            
-        self.dropPheromons()
-        self.reset()
         
 
-# Running NB_RUNS runs with NB_ANTS ants
-ants = []
-# Global pheromons
-pheromons = Pheromons(p)
+# All the ants of the colony travelling together: the same journeys as Ant, with the state of every ant
+# held in arrays (one row per ant) and all the ants moving to their next city in one step
+class Colony():
+
+    _cities = None    # Current city of every ant (ids)
+    _paths = None     # Path of every ant, (ants, n + 1) ids
+    _distances = None # Length of the journey so far of every ant
+    _visited = None   # Seen cities of every ant, (ants, n) mask
+    _step = None      # Number of cities seen by every ant
+    _history = None   # Length of the journeys of every loop
+    _pheromons = None # Pheromons read and dropped by the ants
+
+    def __init__(self, pheromons, nb_ants = NB_ANTS):
+        self._pheromons = pheromons
+        n = len(pheromons)
+        self._paths = np.zeros((nb_ants, n + 1), dtype=int)
+        self._history = []
+        self.start()
+
+    # Every ant starts in a random city
+    def start(self):
+        nb_ants, n = self._paths.shape[0], self._paths.shape[1] - 1
+        self._cities = np.random.randint(0, n, nb_ants)
+        self._paths[:, 0] = self._cities
+        self._distances = np.zeros(nb_ants)
+        self._visited = np.zeros((nb_ants, n), dtype=bool)
+        self._visited[np.arange(nb_ants), self._cities] = True
+        self._step = 1
+
+    def __len__(self):
+        return self._paths.shape[0]
+
+    # One step forward for every ant: pick the next destination city, or go back to the start city
+    # once every city has been seen
+    def nextCities(self):
+        ants = np.arange(len(self))
+
+        if self._step == self._visited.shape[1]:
+            next_cities = self._paths[:, 0]
+        else:
+            next_cities = move(self._pheromons, self._cities, self._visited)
+            self._visited[ants, next_cities] = True
+
+        self._distances += distances(_COORDS, self._cities, next_cities)
+        self._cities = next_cities
+        self._paths[:, self._step] = next_cities
+        self._step += 1
+
+    # One run for every ant: the journeys only, pheromons are dropped by dropPheromons
+    def run(self):
+        while self._step < self._paths.shape[1]:
+            self.nextCities()
+
+    # Update pheromons structure according to the paths length. As with Ant, each edge gets the value
+    # of the last ant going through it.
+    def dropPheromons(self):
+        n = self._visited.shape[1]
+
+        # Edges of every path in both directions (flat ids), with the value of their ant, in the order of the ants
+        values = np.repeat(Q / self._distances, 2 * n)
+        edges = np.concatenate((self._paths[:, :-1] * n + self._paths[:, 1:],
+                                self._paths[:, 1:] * n + self._paths[:, :-1]), axis=1).ravel()
+
+        # Last occurrence of every edge
+        edges, last = np.unique(edges[::-1], return_index=True)
+        self._pheromons[np.divmod(edges, n)] = values[::-1][last]
+
+    # Reset the ants after they did their job (i.e. loop and drop pheromons)
+    def reset(self):
+        self._history.append(self._distances)
+        self.start()
+
+    # (length, ant) of the shortest journey so far
+    def best(self):
+        history = np.array(self._history)
+        ant = np.argmin(history.min(axis=0))
+        return history[:, ant].min(), ant
+
+
+if __name__ == '__main__':
+
+    # Cities: the French cities, or the number of random cities given on the command line
+    if len(sys.argv) > 1:
+        load(random_cities(int(sys.argv[1])))
+
+    # Pheromons shared by the ants
+    pheromons = Pheromons(p)
 
-# Create ants
-for i in range(NB_ANTS):
-    ants.append(Ant())
+    # Running NB_RUNS runs with NB_ANTS ants
+    colony = Colony(pheromons, NB_ANTS)
 
-# Runs
-for k in range(NB_RUNS):
-    pheromons.evaporate()
-    for ant in ants:
-        ant.run()   
+    # Runs: all the ants travel with the same choice info, then pheromons evaporate, the ants drop theirs
+    # and the choice info of the next run is computed
+    for k in range(NB_RUNS):
+        colony.run()
+        pheromons.evaporate()
+        colony.dropPheromons()
+        pheromons.updateChoiceInfo()
+        colony.reset()
 
 
-# Results
-result = (math.inf, -1)
-print(enumerate(ants))
-for k, ant in enumerate(ants):
-    tmp = min(ant._history)
-    if tmp < result[0]:
-        result = (tmp, k)
+    # Results
+    result = colony.best()
                              
         
-print(f"Ant {result[1]} found the shortest path, with length {result[0]} km")  
+    print(f"Ant {result[1]} found the shortest path, with length {result[0]} km")  
         
  
\ No newline at end of file
@@ -0,0 +1,116 @@
+import grid as gr
+import forest as ft
+import numpy as np
+
+# Several independent forests stored as stacked (replicas, nx, ny) planes and updated in one vectorized step.
+# Each replica has its own tree density, humidity rate and random generator, the other parameters
+# (lightning, new growth, wind, grid dimensions) come from a ForestConfig shared by all the replicas.
+class ForestBatch:
+
+    # Stacked planes
+    _trees = None
+    _burning = None
+    _water = None
+
+    # Element counts of each replica
+    _tree = None
+    _init = None
+    _empties = None
+    _burnt = None
+
+    # Parameters shared by the replicas, and parameters of each replica
+    _config = None
+    _density = None
+    _humidity = None
+    _rngs = None
+
+    # seed spawns the random streams of the replicas, unless seeds gives the seed of each replica
+    def __init__(self, densities: list, config=None, humidity=None, seed=None, water=None, seeds=None):
+        if config is None:
+            config = ft.ForestConfig()
+        self._config = config
+
+        n = len(densities)
+        self._density = np.asarray(densities, dtype=float)
+        if humidity is None:
+            humidity = config.humidity
+        self._humidity = np.broadcast_to(np.asarray(humidity, dtype=float), (n,)).reshape(n, 1, 1)
+
+        # One independent random stream per replica
+        if seeds is None:
+            seeds = np.random.SeedSequence(seed).spawn(n)
+        self._rngs = [np.random.default_rng(s) for s in seeds]
+
+        # Water is shared by all the replicas
+        if water is None:
+            water = np.zeros(config.shape, dtype='uint8')
+        self._water = np.asarray(water, dtype='uint8')
+
+        self._trees = np.stack([self.plant(rng, density) for rng, density in zip(self._rngs, self._density)])
+        self._burning = np.zeros(self._trees.shape, dtype='uint8')
+
+        # Element counts
+        self._tree = np.count_nonzero(self._trees, axis=(1, 2))
+        self._init = self._tree.copy()
+        self._empties = np.count_nonzero(self._water == 0) - self._tree
+
+        # If no lightning probability, one tree ignites at the beginning of each replica
+        self._burnt = np.zeros(n, dtype=int)
+        if config.lightning == 0:
+            for k, rng in enumerate(self._rngs):
+                trees = np.flatnonzero(self._trees[k])
+                if len(trees) > 0:
+                    np.put(self._burning[k], rng.choice(trees), 1)
+                    self._burnt[k] = 1
+
+    # Tree plane with density*size trees of random age (from 1 to TREE_MAX_AGE), trees displaced
+    # by the water being planted back on free land cells
+    def plant(self, rng, density: float):
+        return gr.plant(rng, density, self._water.shape, self._water != 0, ft.TREE_MAX_AGE)
+
+    # Number of replicas
+    def __len__(self) -> int:
+        return len(self._density)
+
+    # Replicas with at least one burning tree
+    def burning(self):
+        return self._burnt > 0
+
+    # Percentage of the initial trees burnt in each replica
+    def percentageBurnt(self):
+        return (1 - self._tree / np.maximum(self._init, 1)) * 100
+
+    # Update all the replicas. Without lightning nor new growth, a replica with no burning tree left
+    # can only grow older, so it is frozen and only the replicas still burning are updated.
+    def update(self):
+        config = self._config
+        live = slice(None)
+        if config.lightning == 0 and config.new_growth == 0 and not self.burning().all():
+            live = np.flatnonzero(self.burning())
+
+        # Nothing to update when every replica is frozen
+        replicas = np.arange(len(self))[live]
+        if len(replicas) == 0:
+            return
+
+        hood = ft.neighbourhood(config.wind, config.wind_strength, self._water.shape)
+        burning = self._burning[live]
+        sums = gr.convolve(burning, hood._stencil)
+        rnd = np.stack([self._rngs[k].random((2,) + self._water.shape) for k in replicas], axis=1)
+
+        trees, burning, (d_tree, d_burnt, d_empties) = ft.evolve(self._trees[live], burning, self._water,
+                                                                 sums, hood.cardinality(), rnd, self._humidity[live],
+                                                                 config.lightning, config.new_growth)
+        self._trees[live] = trees
+        self._burning[live] = burning
+        self._tree[live] += d_tree
+        self._burnt[live] += d_burnt
+        self._empties[live] += d_empties
+
+    # Update all the replicas until no tree burns anymore (only ends without lightning)
+    def run(self, max_steps=None):
+        steps = 0
+        while self.burning().any() and (max_steps is None or steps < max_steps):
+            self.update()
+            steps += 1
+        return steps
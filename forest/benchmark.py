@@ -0,0 +1,183 @@
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import forest as ft
+import kernel as kn
+
+# Cases of the benchmark: grid sizes (square grids), tree ratios, wind strengths and scenery (river and clouds)
+SIZES = (90, 500, 2000)
+RATIOS = (0.5, 0.7)
+WIND_STRENGTHS = (0, 1, 2, 3)
+SCENERIES = (True, False)
+# Regimes: fire (one tree ignites, no lightning nor growth, the regime of the sparse engine)
+# and dynamic (lightning and growth of the interactive simulation)
+REGIMES = ("fire", "dynamic")
+
+# The scalar engine takes seconds per step above this number of cells, it is left out of larger cases
+SCALAR_MAX_CELLS = 100 * 100
+# Time spent updating the forest of a case (s), between one and MAX_STEPS steps
+BUDGET = 0.5
+MAX_STEPS = 50
+SEED = 0
+
+# Engines available here (jit needs numba)
+def engines() -> list:
+    return ["scalar", "numpy", "sparse"] + (["jit"] if kn.available() else [])
+
+def case_config(size: int, ratio: float, wind_strength: int, scenery: bool, regime: str, engine: str) -> ft.ForestConfig:
+    parameters = dict(shape=(size, size), tree_ratio=ratio, wind=1 if wind_strength > 0 else 0,
+                      wind_strength=wind_strength, engine=engine)
+    if not scenery:
+        parameters.update(river=None, clouds=None)
+    if regime == "fire":
+        parameters.update(lightning=0, new_growth=0)
+    return ft.ForestConfig(**parameters)
+
+# Steps per second and time per cell of the updates of a forest, updated for budget seconds at most
+def measure(config: ft.ForestConfig, seed: int, budget=BUDGET, max_steps=MAX_STEPS) -> dict:
+    start = time.perf_counter()
+    forest = ft.Forest(config, seed=seed)
+    init = time.perf_counter() - start
+
+    steps = 0
+    elapsed = 0.0
+    while steps < max_steps and (steps == 0 or elapsed < budget):
+        start = time.perf_counter()
+        forest.update()
+        elapsed += time.perf_counter() - start
+        steps += 1
+
+    cells = config.shape[0] * config.shape[1]
+    return {"init_seconds": init, "steps": steps, "seconds": elapsed, "steps_per_second": steps / elapsed,
+            "ns_per_cell": elapsed / steps / cells * 1e9}
+
+# Peak of the memory allocated while building a forest and updating it twice (bytes). Measured apart from
+# the timings since tracing the allocations slows them down.
+def peak_memory(config: ft.ForestConfig, seed: int) -> int:
+    tracemalloc.start()
+    try:
+        forest = ft.Forest(config, seed=seed)
+        forest.update()
+        forest.update()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def cases(sizes=SIZES, ratios=RATIOS, wind_strengths=WIND_STRENGTHS, sceneries=SCENERIES, regimes=REGIMES,
+          engine_names=None):
+    for size, ratio, ws, scenery, regime, engine in itertools.product(sizes, ratios, wind_strengths, sceneries,
+                                                                     regimes, engine_names or engines()):
+        # The sparse engine falls back to the numpy engine with lightning or growth
+        if engine == "sparse" and regime != "fire":
+            continue
+        if engine == "scalar" and size * size > SCALAR_MAX_CELLS:
+            continue
+        yield {"size": size, "ratio": ratio, "wind_strength": ws, "scenery": scenery, "regime": regime, "engine": engine}
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment() -> dict:
+    return {"revision": revision(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine(), "jit": kn.available()}
+
+# Times every case, reporting each one on stderr as it is done
+def benchmark(case_list, budget=BUDGET, max_steps=MAX_STEPS, seed=SEED, memory=True) -> list:
+    # Compiles the kernel before the first timed jit case
+    if kn.available():
+        ft.Forest(ft.ForestConfig(shape=(10, 10), engine="jit"), seed=seed).update()
+
+    results = []
+    for case in case_list:
+        config = case_config(**case)
+        result = dict(case, **measure(config, seed, budget, max_steps))
+        if memory:
+            result["peak_bytes"] = peak_memory(config, seed)
+        results.append(result)
+        print(f"{case}: {result['steps_per_second']:.1f} steps/s, {result['ns_per_cell']:.1f} ns/cell",
+              file=sys.stderr)
+    return results
+
+# Seeded statistical equivalence of the engines with the reference scalar update: every engine runs the same
+# seeded replicas, and the mean tree and burning counts of every step must stay within z standard errors
+# of those of the scalar engine. The numpy and jit engines draw the same random fields, so they must be identical.
+def equivalence(replicas=24, steps=30, size=48, seed=SEED, z=4.0) -> dict:
+    regimes = {
+        "fire": dict(lightning=0, new_growth=0, humidity=0.2, wind=2, wind_strength=2, tree_ratio=0.7),
+        "dynamic": dict(lightning=0.002, new_growth=0.02, humidity=0.3, wind=3, wind_strength=1),
+    }
+    report = {}
+    for regime, parameters in regimes.items():
+        counts = {}
+        for engine in engines():
+            if engine == "sparse" and regime != "fire":
+                continue
+            config = ft.ForestConfig(shape=(size, size), engine=engine, **parameters)
+            runs = np.zeros((replicas, steps, 2))
+            for r in range(replicas):
+                forest = ft.Forest(config, seed=[seed, r])
+                for step in range(steps):
+                    forest.update()
+                    forest.update_clouds()
+                    runs[r, step] = forest._tree, forest._burnt
+            counts[engine] = runs
+
+        reference = counts["scalar"]
+        for engine, runs in counts.items():
+            if engine == "scalar":
+                continue
+            error = np.sqrt(reference.var(axis=0, ddof=1) / replicas + runs.var(axis=0, ddof=1) / replicas)
+            scores = np.abs(runs.mean(axis=0) - reference.mean(axis=0)) / np.maximum(error, 1e-9)
+            report[f"{regime}/{engine}"] = {"max_z": float(scores.max()), "passed": bool(scores.max() <= z)}
+        if "jit" in counts:
+            identical = bool(np.array_equal(counts["jit"], counts["numpy"]))
+            report[f"{regime}/jit"].update(identical_to_numpy=identical, passed=report[f"{regime}/jit"]["passed"] and identical)
+    return report
+
+def parse(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks the forest update engines and checks their equivalence")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--ratios", type=float, nargs="+", default=RATIOS)
+    parser.add_argument("--wind-strengths", type=int, nargs="+", default=WIND_STRENGTHS)
+    parser.add_argument("--engines", nargs="+", choices=("scalar", "numpy", "sparse", "jit"), default=None)
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds of updates per case")
+    parser.add_argument("--steps", type=int, default=MAX_STEPS, help="maximum number of steps per case")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--quick", action="store_true", help="90x90 and 500x500 grids, one ratio, wind strengths 0 and 2")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory measures")
+    parser.add_argument("--no-equivalence", action="store_true", help="skip the equivalence check")
+    parser.add_argument("--output", default=None, help="JSON file of the results (stdout if not given)")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse()
+    sizes, ratios, wind_strengths = args.sizes, args.ratios, args.wind_strengths
+    if args.quick:
+        sizes, ratios, wind_strengths = (90, 500), (0.5,), (0, 2)
+
+    results = {"environment": environment()}
+    results["cases"] = benchmark(cases(sizes, ratios, wind_strengths, engine_names=args.engines), args.budget,
+                                 args.steps, args.seed, not args.no_memory)
+    if not args.no_equivalence:
+        results["equivalence"] = equivalence(seed=args.seed)
+        print(f"Equivalence: {results['equivalence']}", file=sys.stderr)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    # Fails when an engine departs from the reference update
+    if not all(check["passed"] for check in results.get("equivalence", {}).values()):
+        sys.exit(1)
@@ -1,5 +1,9 @@
+import json
 import grid as gr
-import random
+import kernel as kn
+import stats as st
+import profiler as pf
+import numpy as np
 
 # Globals
 
@@ -29,10 +33,17 @@ WIND = 0
 WIND_STRENGTH = 0
 WIND_MAX = 3
 
-def humidity_color():
+# Update engine used by Forest.update (scalar, numpy, sparse, jit)
+# The sparse engine only evaluates the cells around the fire front, it needs LIGHTNING = 0 and NEW_GROWTH = 0
+# The jit engine runs a compiled kernel (numba), it falls back to the numpy engine when numba is missing
+ENGINE = "scalar"
+
+def humidity_color(humidity=None):
     #(190,100,29) LIGHT
     #(82,46,13) DARK
-    return (150 - HUMIDITY * 80, 100 - HUMIDITY * 54, 29 - HUMIDITY * 16)
+    if humidity is None:
+        humidity = HUMIDITY
+    return (150 - humidity * 80, 100 - humidity * 54, 29 - humidity * 16)
 
 def clouds_color(color: tuple):
     cloud = [color[i] - COLOR_CLOUDS[i] for i in range(3)]
@@ -41,10 +52,206 @@ def clouds_color(color: tuple):
         if cloud[i] < 0:
             cloud[i] = 0
     return tuple(cloud)
- 
+
+# Neighbourhoods of the cells able to ignite a cell, keyed by (wind, wind strength, grid shape)
+_neighbourhoods = {}
+
+# Neighbourhood depending on the wind (same cells as Grid.furtherNeighbours), computed once per key
+def neighbourhood(wind: int, ws: int, shape: tuple) -> gr.Neighbourhood:
+    if wind == 0 or ws == 0:
+        wind, ws = 0, 0
+    key = (wind, ws, tuple(shape))
+    hood = _neighbourhoods.get(key)
+    if hood is None:
+        offsets = gr.Grid._indexVoisins
+        if wind > 0:
+            v = WINDS[wind]
+            offsets = [w for w in offsets if w[v[0]] != v[1]]
+        hood = gr.Neighbourhood(offsets, max(ws, 1), tuple(shape))
+        _neighbourhoods[key] = hood
+    return hood
+
+# Drops the cached neighbourhoods of a wind (all of them by default)
+def evict_neighbourhoods(wind: int = None, ws: int = None):
+    for key in list(_neighbourhoods.keys()):
+        if (wind is None or key[0] == wind) and (ws is None or key[1] == ws):
+            del _neighbourhoods[key]
+
+# Scratch planes of the evolution rules (neighbour sums, ignition thresholds and boolean masks), allocated
+# once so that evolve allocates nothing when it is given them
+class Workspace:
+
+    _sums = None
+    _ratios = None
+    _masks = None
+
+    # Number of boolean masks used by evolve
+    MASKS = 16
+
+    def __init__(self, shape: tuple):
+        self._sums = np.empty(shape, dtype='int32')
+        self._ratios = np.empty(shape)
+        self._masks = np.empty((self.MASKS,) + tuple(shape), dtype=bool)
+
+    # Memory used by the scratch planes
+    def nbytes(self) -> int:
+        return self._sums.nbytes + self._ratios.nbytes + self._masks.nbytes
+
+# Applies the evolution rules to whole planes at once. sums and counts describe the burning
+# neighbourhood of every cell, rnd holds two uniform random fields (first and second draw of a cell).
+# The new planes are written in out (trees, burning) when given, allocated otherwise, and the number of cells
+# of each event (stats.EVENTS) in the events dict when given. The masks are computed in the planes of work
+# (a Workspace of the shape of the planes), allocated for this call if not given. The age and burning time
+# histograms of the planes in the histograms dict (ages, times) are replaced by those of the new planes when given,
+# from the burning cells and the event masks instead of the whole planes.
+# Returns the new planes and the variation of the (tree, burnt, empties) counts.
+@pf.timed("rules")
+def evolve(trees, burning, water, sums, counts, rnd, humidity, lightning, new_growth, out=None, events=None,
+           work=None, histograms=None) -> tuple:
+    if work is None:
+        work = Workspace(trees.shape)
+    (land, alive, on_fire, idle, empty, stop, extinct, cooled, burn, dies, ignite, calm, struck, older, grown,
+     scratch) = work._masks
+
+    np.equal(water, 0, out=land)
+    np.greater(trees, 0, out=alive)
+    np.logical_and(alive, land, out=alive)
+    np.greater(burning, 0, out=on_fire)
+    np.logical_and(on_fire, alive, out=on_fire)
+    np.logical_xor(alive, on_fire, out=idle)
+    np.logical_xor(land, alive, out=empty)
+
+    # Burning trees: stop burning depending on the humidity rate, otherwise burn or die
+    stop_drop = np.floor(np.multiply(humidity, 10)).astype(burning.dtype)
+    np.less_equal(rnd[0], humidity, out=stop)
+    np.logical_and(stop, on_fire, out=stop)
+    np.less_equal(burning, stop_drop, out=extinct)
+    np.logical_and(extinct, stop, out=extinct)
+    np.logical_xor(stop, extinct, out=cooled)
+    np.logical_xor(on_fire, stop, out=scratch)
+    np.greater(trees, 1, out=burn)
+    np.logical_and(burn, scratch, out=burn)
+    np.logical_xor(scratch, burn, out=dies)
+
+    # Non-burning trees: ignite from burning neighbours or lightning, otherwise grow older
+    ratios = work._ratios
+    np.multiply(sums, 1 - humidity, out=ratios)
+    np.greater(counts, 0, out=scratch)
+    np.divide(ratios, counts, out=ratios, where=scratch)
+    np.less(rnd[0], ratios, out=ignite)
+    np.logical_and(ignite, idle, out=ignite)
+    np.logical_xor(idle, ignite, out=calm)
+    np.less_equal(rnd[1], lightning, out=struck)
+    np.logical_and(struck, calm, out=struck)
+    np.logical_xor(calm, struck, out=older)
+    np.less(trees, TREE_MAX_AGE, out=scratch)
+    np.logical_and(older, scratch, out=older)
+
+    # Empty cells: grow a new tree depending on the humidity rate
+    np.less_equal(rnd[0], new_growth * (1 + np.multiply(humidity, 10)), out=grown)
+    np.logical_and(grown, empty, out=grown)
+
+    if out is None:
+        out = (np.empty_like(trees), np.empty_like(burning))
+    new_trees, new_burning = out
+
+    np.copyto(new_trees, trees)
+    np.subtract(trees, 1, out=new_trees, where=burn)
+    np.add(trees, 1, out=new_trees, where=older)
+    np.copyto(new_trees, 0, where=dies)
+    np.copyto(new_trees, 1, where=grown)
+
+    np.copyto(new_burning, burning)
+    np.subtract(burning, stop_drop, out=new_burning, where=cooled)
+    np.add(burning, 1, out=new_burning, where=burn)
+    np.copyto(new_burning, 0, where=extinct)
+    np.copyto(new_burning, 0, where=dies)
+    np.copyto(new_burning, 1, where=ignite)
+    np.copyto(new_burning, 1, where=struck)
+
+    count = lambda mask: np.count_nonzero(mask, axis=(-2, -1))
+    d_tree = count(grown) - count(dies)
+    d_burnt = count(ignite) + count(struck) - count(extinct) - count(dies)
+    if events is not None:
+        # The fire front: non-burning trees with a burning neighbour
+        np.greater(sums, 0, out=scratch)
+        np.logical_and(scratch, idle, out=scratch)
+        events.update(ignited=count(ignite), struck=count(struck), grown=count(grown), died=count(dies),
+                      extinguished=count(extinct), exposed=count(scratch))
+    if histograms is not None:
+        # Burning trees (few) are counted in the planes, the other changes follow from the event counts
+        # and the histograms themselves: idle trees (no tree standing in water) below max age grow older
+        # unless they ignite
+        ages, times = histograms["ages"], histograms["times"]
+        hist = lambda plane, cells: np.bincount(plane.ravel()[cells], minlength=len(ages))
+        fire = np.flatnonzero(on_fire)
+        np.logical_or(ignite, struck, out=scratch)
+        lit = np.flatnonzero(scratch)
+        fire_ages = hist(trees, fire)
+        older_ages = ages - fire_ages - hist(trees, lit)
+        older_ages[0] = older_ages[-1] = 0
+        ages = ages - fire_ages - older_ages + hist(new_trees, fire)
+        ages[1:] += older_ages[:-1]
+        ages[0] -= count(grown)
+        ages[1] += count(grown)
+
+        times = times - hist(burning, fire) + hist(new_burning, fire)
+        times[0] -= len(lit)
+        times[1] += len(lit)
+        histograms.update(ages=ages, times=times)
+    return new_trees, new_burning, (d_tree, d_burnt, -d_tree)
+
+# Parameters of one forest and dimensions of its grids, defaulting to the module globals
+class ForestConfig:
+
+    humidity = None
+    lightning = None
+    new_growth = None
+    tree_ratio = None
+    river = None
+    river_width = None
+    clouds = None
+    wind = None
+    wind_strength = None
+    shape = None
+    engine = None
+
+    def __init__(self, **parameters):
+        self.humidity = HUMIDITY
+        self.lightning = LIGHTNING
+        self.new_growth = NEW_GROWTH
+        self.tree_ratio = TREE_RATIO
+        self.river = RIVER
+        self.river_width = RIVER_WIDTH
+        self.clouds = CLOUDS
+        self.wind = WIND
+        self.wind_strength = WIND_STRENGTH
+        self.shape = gr.__gridDim__
+        self.engine = ENGINE
+
+        for name, value in parameters.items():
+            if not hasattr(self, name):
+                raise TypeError(f"Unknown forest parameter: {name}")
+            setattr(self, name, value)
+        self.shape = tuple(self.shape)
+
+    # Copy of the config with some parameters changed
+    def copy(self, **parameters):
+        return ForestConfig(**dict(vars(self), **parameters))
+
+    def __repr__(self):
+        return "ForestConfig(" + ", ".join(f"{name}={value!r}" for name, value in vars(self).items()) + ")"
+
+# Planes of a forest, in their order in the plane store
+PLANES = ("trees", "burning", "water", "clouds")
+
 class Forest:
 
-    # Grids
+    # Parameters
+    _config = None
+
+    # Grids, all packed in one plane store
+    _store = None
     _trees = None
     _burning = None
     _water = None
@@ -55,91 +262,198 @@ class Forest:
     _init = None
     _empties = None
     _burnt = None
+
+    # Statistics: age and burning time histograms kept up to date by the updates, events of the current
+    # update and record of the last one
+    _ages = None
+    _times = None
+    _events = None
+    _stats = None
+
+    # Active set of the sparse engine: burning cells and non-burning trees still growing older (flat indices)
+    _front = None
+    _young = None
+
+    # Random generator of this forest, drawing everything from the initial state to the updates
+    _rng = None
+
+    # Scratch planes of the engines updating whole planes (random fields, evolve workspace), allocated on first use
+    _rnd = None
+    _work = None
     
-    def __init__(self):
+    # seed is anything numpy.random.default_rng accepts (int, SeedSequence, Generator), a fresh stream if None
+    def __init__(self, config=None, seed=None):
+
+        # Parameters of this forest, taken from the module globals if not given
+        if config is None:
+            config = ForestConfig()
+        self._config = config
+        self._rng = np.random.default_rng(seed)
+        nx, ny = config.shape
         
         # Grids needed to store burning and tree states of cells
-        self._burning = gr.Grid()
+        self._store = gr.PlaneStore(PLANES, config.shape)
+        self._burning = gr.Grid(shape=config.shape, buffers=self._store.buffers("burning"))
 
-        if RIVER is not None:
-            self._water = gr.Grid(empty=False, river=RIVER, river_width=RIVER_WIDTH)
+        if config.river is not None:
+            self._water = gr.Grid(empty=False, river=config.river, river_width=config.river_width, shape=config.shape,
+                                  buffers=self._store.buffers("water"), rng=self._rng)
         else:
-            self._water = gr.Grid()
+            self._water = gr.Grid(shape=config.shape, buffers=self._store.buffers("water"))
 
-        if CLOUDS is not None:
-            clouds = self.generate_clouds(CLOUDS)
-            self._clouds = gr.Grid(empty=False, clouds=clouds)
+        if config.clouds is not None:
+            clouds = self.generate_clouds(config.clouds)
+            self._clouds = gr.Grid(empty=False, clouds=clouds, shape=config.shape, buffers=self._store.buffers("clouds"))
         else:
-            self._clouds = gr.Grid()
+            self._clouds = gr.Grid(shape=config.shape, buffers=self._store.buffers("clouds"))
 
-        forbidden = [(x, y) for x in range(gr.nx) for y in range(gr.ny) if self._water[x,y] == 1]
-        self._trees = gr.Grid(empty=False, ratio=TREE_RATIO, forbidden=forbidden)
+        self._trees = gr.Grid(empty=False, ratio=config.tree_ratio, forbidden=self._water._gridbis != 0, shape=config.shape,
+                              buffers=self._store.buffers("trees"), rng=self._rng)
         
-        # Element counts 
-        self._tree = gr.nx * gr.ny * TREE_RATIO
+        # Element counts, from the planted trees
+        self._tree = int(np.count_nonzero(self._trees._gridbis))
         self._init = self._tree
-        self._empties = gr.nx * gr.ny * (1-TREE_RATIO)
+        self._empties = int(np.count_nonzero(self._water._gridbis == 0)) - self._tree
 
         # If no lightning probability, one tree ignites at the beginning (usefull for percolation)
-        if LIGHTNING == 0:
-            bx = random.randint(0, gr.nx - 1)
-            by = random.randint(0, gr.ny - 1)
-            while self._trees[bx, by] == 0:
-                bx = random.randint(0, gr.nx - 1)
-                by = random.randint(0, gr.ny - 1)
-            self._burning[bx, by] = 1
-            self._burning._gridbis[bx, by] = 1
-            self._burnt = 1
+        if config.lightning == 0:
+            self._burnt = 0
+            trees = np.flatnonzero(self._trees._gridbis)
+            if len(trees) > 0:
+                bx, by = np.divmod(self._rng.choice(trees), ny)
+                self._burning[bx, by] = 1
+                self._burning._gridbis[bx, by] = 1
+                self._burnt = 1
         else:
             self._burnt = 0
 
-    def generate_clouds(self, n: int) -> list:
-        clouds = []
-        for k in range(n):
-            x = random.randint(0, gr.nx - 1)
-            y = random.randint(0, gr.ny - 1)
-            w = random.randint(5, 15)
-            h = random.randint(10, 20)
-
-            for i in range(w):
-                if i != 0 and i != w - 1:
-                    clouds.append(((x + i) % gr.nx, (y - 1) % gr.ny))
-                    clouds.append(((x + i) % gr.nx, (y + h) % gr.ny))
-                for j in range(h):
-                    clouds.append(((x + i) % gr.nx, (y + j) % gr.ny))
-        return clouds   
+        self.histograms()
+        self._events = dict.fromkeys(st.EVENTS, 0)
+        self.record()
+
+    # Complete state of the forest (current planes, counters, random generator state, parameters) as a dict of arrays
+    def state(self) -> dict:
+        planes = {name: getattr(self, "_" + name)._gridbis.copy() for name in PLANES}
+        counters = np.array([self._tree, self._init, self._empties, self._burnt], dtype='int64')
+        return dict(planes, counters=counters, rng=json.dumps(self._rng.bit_generator.state),
+                    config=json.dumps(vars(self._config)))
+
+    # Forest in a given state, without drawing anything
+    @classmethod
+    def from_state(cls, state) -> 'Forest':
+        config = json.loads(str(state["config"]))
+        config["shape"] = tuple(config["shape"])
+        forest = cls.__new__(cls)
+        forest._config = ForestConfig(**config)
+
+        rng = json.loads(str(state["rng"]))
+        forest._rng = np.random.Generator(getattr(np.random, rng["bit_generator"])())
+        forest._rng.bit_generator.state = rng
+
+        forest._store = gr.PlaneStore(PLANES, forest._config.shape)
+        for name in PLANES:
+            grid = gr.Grid(shape=forest._config.shape, buffers=forest._store.buffers(name))
+            np.copyto(grid._gridbis, state[name])
+            grid.copyToNext()
+            setattr(forest, "_" + name, grid)
+
+        tree, init, empties, burnt = np.asarray(state["counters"]).tolist()
+        forest._tree, forest._init, forest._empties, forest._burnt = tree, init, empties, burnt
+        forest.histograms()
+        forest._events = dict.fromkeys(st.EVENTS, 0)
+        forest.record()
+        return forest
+
+    # Independent copy of the forest, random generator included
+    def copy(self) -> 'Forest':
+        return Forest.from_state(self.state())
+
+    # Checkpoint of the complete state in a binary file (.npz)
+    def save(self, path: str):
+        np.savez(path, **self.state())
+
+    @classmethod
+    def load(cls, path: str) -> 'Forest':
+        with np.load(path) as state:
+            return cls.from_state(state)
+
+    # Recomputes the age and burning time histograms from the planes
+    @pf.timed("histograms")
+    def histograms(self):
+        self._ages = st.histogram(self._trees._gridbis, TREE_MAX_AGE + 1)
+        self._times = st.histogram(self._burning._gridbis, TREE_MAX_AGE + 1)
+
+    # Records the statistics of the update that just ran
+    def record(self):
+        events = {name: int(count) for name, count in self._events.items()}
+        self._stats = st.Stats(self._tree, self._burnt, self._empties, self._ages, self._times, events)
+
+    # Uniform random fields drawn by the engines updating whole planes, written in out when given
+    @pf.timed("rng")
+    def random_fields(self, shape: tuple, out=None):
+        if out is None:
+            return self._rng.random(shape)
+        return self._rng.random(out=out)
+
+    # Two random fields of the shape of the planes, drawn in the same buffer at every update
+    def plane_fields(self):
+        if self._rnd is None:
+            self._rnd = np.empty((2,) + tuple(self._config.shape))
+        return self.random_fields(self._rnd.shape, self._rnd)
+
+    # Statistics of the last update (of the initial state before the first one)
+    def stats(self) -> st.Stats:
+        return self._stats
+
+    # Coordinates (xs, ys) of n clouds: w*h rectangles (w in 5-15, h in 10-20) at (x, y) with rounded
+    # top and bottom rows, wrapping around the grid. All the rectangles are stamped at once.
+    def generate_clouds(self, n: int) -> tuple:
+        nx, ny = self._config.shape
+        x = self._rng.integers(0, nx, n)[:, None, None]
+        y = self._rng.integers(0, ny, n)[:, None, None]
+        w = self._rng.integers(5, 16, n)[:, None, None]
+        h = self._rng.integers(10, 21, n)[:, None, None]
+
+        # Columns i and rows j (from the row above to the row below the rectangle) of every cloud
+        i = np.arange(15)[None, :, None]
+        j = np.arange(-1, 21)[None, None, :]
+        inside = (i < w) & (((j >= 0) & (j < h)) | (((j == -1) | (j == h)) & (i != 0) & (i != w - 1)))
+
+        xs = np.broadcast_to((x + i) % nx, inside.shape)
+        ys = np.broadcast_to((y + j) % ny, inside.shape)
+        return xs[inside], ys[inside]
     
     # Get state of a cell i.e (tree?, burning?, water?)
     def getCell(self, x: int, y: int) -> tuple:
-        return (self._trees._gridbis[x, y], self._burning._gridbis[x, y],
-                 self._water._gridbis[x, y], self._clouds._gridbis[x, y])
+        return (int(self._trees._gridbis[x, y]), int(self._burning._gridbis[x, y]),
+                 int(self._water._gridbis[x, y]), int(self._clouds._gridbis[x, y]))
         
     # Tree igniting and age growing treatment
     def ignite_grow(self, x: int, y: int):
 
         # Computes the neighbours of the cell (x, y) depending on the wind
-        self._burning.resetIndexVoisins()
-        if WIND > 0 and WIND_STRENGTH > 0:
-            v = WINDS[WIND]
-            self._burning._indexVoisins = [ w for w in self._burning._indexVoisins if w[v[0]] != v[1]]
-            neighbours = self._burning.furtherNeighbours(x, y, WIND_STRENGTH)
-            
-        else:
-            neighbours = self._burning.voisins(x, y)
+        config = self._config
+        hood = neighbourhood(config.wind, config.wind_strength, config.shape)
+        neighbours = self._burning.neighbours(hood, x, y)
 
         # Ignites with a probability that depends on the number of neighbours burning and the humidity rate
-        ignite_prob = (1 - HUMIDITY) * sum(neighbours) * 1.0/len(neighbours)
-        rnd_ignite = random.random()
+        total = sum(map(int, neighbours))
+        if total > 0:
+            self._events["exposed"] += 1
+        ignite_prob = (1 - config.humidity) * total * 1.0/len(neighbours)
+        rnd_ignite = self._rng.random()
         if rnd_ignite < ignite_prob:
             self._burning[x, y] = 1
             self._burnt += 1
+            self._events["ignited"] += 1
 
         else:          
             # Ignites due to lightning with a certain probability 
-            rnd_ignite = random.random()
-            if rnd_ignite <= LIGHTNING: 
+            rnd_ignite = self._rng.random()
+            if rnd_ignite <= config.lightning: 
                 self._burning[x, y] = 1 
                 self._burnt += 1
+                self._events["struck"] += 1
             else: 
                 self._burning[x, y] = 0
                 # Grows older if not at max age yet
@@ -149,24 +463,29 @@ class Forest:
     # Growing treatment 
     def grow(self, x: int, y: int):
         # A new tree grows from empty cell with a probability depending on humidity rate
-        rnd_growth = random.random()
-        if rnd_growth <= NEW_GROWTH * (1 + HUMIDITY * 10): 
+        rnd_growth = self._rng.random()
+        if rnd_growth <= self._config.new_growth * (1 + self._config.humidity * 10): 
             self._trees[x, y] = 1 
             self._tree += 1
             self._empties -= 1
+            self._events["grown"] += 1
     
     # Treatment for a burning tree: can stop burning, continue or die
     def burning_treatment(self, x: int, y: int):
 
         # Stops burning depending on the humidity rate
-        rnd_stop = random.random()
-        if rnd_stop <= HUMIDITY:
-            self._burning[x, y] -= int(HUMIDITY * 10)
+        humidity = self._config.humidity
+        rnd_stop = self._rng.random()
+        if rnd_stop <= humidity:
+            fire = int(self._burning[x, y]) - int(humidity * 10)
 
             # Stops burning
-            if self._burning[x, y] <= 0:
+            if fire <= 0:
                 self._burning[x, y] = 0
                 self._burnt -= 1
+                self._events["extinguished"] += 1
+            else:
+                self._burning[x, y] = fire
 
         else:
             # Tree is not fully burnt
@@ -181,12 +500,40 @@ class Forest:
                 self._burnt -= 1
                 self._tree -= 1
                 self._empties += 1
+                self._events["died"] += 1
     
-    # Update forest
+    # Update forest with the selected engine, then record the statistics of the update
+    @pf.timed("update")
     def update(self):
+        config = self._config
+        self._events = dict.fromkeys(st.EVENTS, 0)
+
+        if config.engine == "sparse" and config.lightning == 0 and config.new_growth == 0:
+            self.update_sparse()
+        else:
+            # The active set of the sparse engine is rebuilt once another engine has run
+            self._front = None
+            if config.engine == "jit" and kn.available():
+                self.update_jit()
+            elif config.engine in ("numpy", "sparse", "jit"):
+                self.update_numpy()
+            else:
+                self.update_scalar()
+
+        self.record()
+
+    # Update forest cell by cell
+    def update_scalar(self):
+        nx, ny = self._config.shape
+
+        # Cells not treated keep their state
+        self._trees.copyToNext()
+        self._burning.copyToNext()
+        ages = self._ages.tolist()
+        times = self._times.tolist()
         
-        for x in range(gr.nx):
-            for y in range(gr.ny):
+        for x in range(nx):
+            for y in range(ny):
                 
                 cell = self.getCell(x, y)
 
@@ -207,21 +554,136 @@ class Forest:
                     # Treatment for an empty cell: can grow a new tree
                     else:
                         self.grow(x, y)
+
+                    # Histograms follow the new state of the cell
+                    ages[cell[0]] -= 1
+                    ages[self._trees._grid[x, y]] += 1
+                    times[cell[1]] -= 1
+                    times[self._burning._grid[x, y]] += 1
         
-        #Update copies
+        # Swap current and next states
         self._trees.updateBis()
         self._burning.updateBis()
+        self._ages = np.array(ages)
+        self._times = np.array(times)
 
-    def update_clouds(self):
-        dxy = [(0, 0), (0, -1), (1, 0), (0, 1), (-1, 0)]
-        dx = dxy[WIND][0] * WIND_STRENGTH
-        dy = dxy[WIND][1] * WIND_STRENGTH
+    # Update forest applying the evolution rules to whole planes
+    def update_numpy(self):
+        config = self._config
+        trees = self._trees._gridbis
+        burning = self._burning._gridbis
 
-        for x in range(gr.nx):
-            for y in range(gr.ny):
-                self._clouds[(x + dx) % gr.nx, (y + dy) % gr.ny] = self._clouds._gridbis[x, y]
+        if self._work is None:
+            self._work = Workspace(trees.shape)
+        hood = neighbourhood(config.wind, config.wind_strength, config.shape)
+        sums, counts = self._burning.neighbourSums(hood, out=self._work._sums)
+        rnd = self.plane_fields()
+        out = (self._trees._grid, self._burning._grid)
+        histograms = dict(ages=self._ages, times=self._times)
+        d_tree, d_burnt, d_empties = evolve(trees, burning, self._water._gridbis, sums, counts, rnd,
+                                            config.humidity, config.lightning, config.new_growth, out, self._events,
+                                            self._work, histograms)[2]
+        self._ages, self._times = histograms["ages"], histograms["times"]
+        self._tree += int(d_tree)
+        self._burnt += int(d_burnt)
+        self._empties += int(d_empties)
 
+        # Swap current and next states
+        self._trees.updateBis()
+        self._burning.updateBis()
+
+    # Update forest with the compiled kernel, drawing the same random fields as the numpy engine
+    def update_jit(self):
+        config = self._config
+        trees = self._trees._gridbis
+        hood = neighbourhood(config.wind, config.wind_strength, config.shape)
+
+        rnd = self.plane_fields()
+        out = (self._trees._grid, self._burning._grid)
+        histograms = dict(ages=self._ages, times=self._times)
+        d_tree, d_burnt, d_empties = kn.evolve(trees, self._burning._gridbis, self._water._gridbis, hood._stencil, rnd,
+                                               config.humidity, config.lightning, config.new_growth, TREE_MAX_AGE, out,
+                                               self._events, histograms)[2]
+        self._ages, self._times = histograms["ages"], histograms["times"]
+        self._tree += int(d_tree)
+        self._burnt += int(d_burnt)
+        self._empties += int(d_empties)
+
+        # Swap current and next states
+        self._trees.updateBis()
+        self._burning.updateBis()
+
+    # Update forest evaluating only the burning cells and the trees they can ignite.
+    # Without lightning nor new growth, any other tree can only grow older, which is applied
+    # to the trees not at max age yet, so that the cost follows the length of the fire front.
+    def update_sparse(self):
+        config = self._config
+        trees = self._trees._gridbis
+        burning = self._burning._gridbis
+        nx, ny = trees.shape
+        hood = neighbourhood(config.wind, config.wind_strength, config.shape)
+        offsets = np.array(hood._stencil).reshape(-1, 2)
+
+        if self._front is None:
+            self._front = np.flatnonzero(burning)
+            self._young = np.flatnonzero((trees > 0) & (trees < TREE_MAX_AGE) & (burning == 0)
+                                         & (self._water._gridbis == 0))
+
+        # Active cells: the burning cells and the cells having one of them in their neighbourhood
+        fx, fy = np.divmod(self._front, ny)
+        cx = fx[:, None] - offsets[:, 0]
+        cy = fy[:, None] - offsets[:, 1]
+        inside = (cx >= 0) & (cx < nx) & (cy >= 0) & (cy < ny)
+        active = np.union1d(self._front, cx[inside] * ny + cy[inside])
+
+        # Burning sum over the neighbourhood of the active cells
+        ax, ay = np.divmod(active, ny)
+        vx = ax[:, None] + offsets[:, 0]
+        vy = ay[:, None] + offsets[:, 1]
+        inside = (vx >= 0) & (vx < nx) & (vy >= 0) & (vy < ny)
+        sums = np.where(inside, burning[np.clip(vx, 0, nx - 1), np.clip(vy, 0, ny - 1)], 0).sum(axis=1)
+
+        cells = lambda plane: plane.ravel()[active][None]
+        rnd = self.random_fields((2, 1, len(active)))
+        new_trees, new_burning, (d_tree, d_burnt, d_empties) = evolve(cells(trees), cells(burning),
+                                                                      cells(self._water._gridbis), sums[None],
+                                                                      cells(hood.cardinality()), rnd,
+                                                                      config.humidity, config.lightning, config.new_growth,
+                                                                      events=self._events)
+        new_trees, new_burning = new_trees[0], new_burning[0]
+
+        # Trees out of reach of the fire grow older
+        young = np.setdiff1d(self._young, active, assume_unique=True)
+        ages = trees.ravel()[young] + 1
+
+        # Histograms follow the changed cells only
+        length = TREE_MAX_AGE + 1
+        self._ages = (self._ages - st.histogram(cells(trees), length) + st.histogram(new_trees, length)
+                      - st.histogram(ages - 1, length) + st.histogram(ages, length))
+        self._times = self._times - st.histogram(cells(burning), length) + st.histogram(new_burning, length)
+
+        # Cells are updated in place in the current state
+        np.put(self._trees._gridbis, active, new_trees)
+        np.put(self._trees._gridbis, young, ages)
+        np.put(self._burning._gridbis, active, new_burning)
+
+        self._front = active[new_burning > 0]
+        growing = (new_trees > 0) & (new_trees < TREE_MAX_AGE) & (new_burning == 0) & (cells(self._water._gridbis)[0] == 0)
+        self._young = np.union1d(young[ages < TREE_MAX_AGE], active[growing])
+
+        self._tree += int(d_tree)
+        self._burnt += int(d_burnt)
+        self._empties += int(d_empties)
+
+    @pf.timed("clouds")
+    def update_clouds(self):
+        config = self._config
+        dxy = [(0, 0), (0, -1), (1, 0), (0, 1), (-1, 0)]
+        dx = dxy[config.wind][0] * config.wind_strength
+        dy = dxy[config.wind][1] * config.wind_strength
 
+        # Clouds move with the wind, wrapping around the grid
+        self._clouds.shift(dx, dy)
         self._clouds.updateBis()
                     
 
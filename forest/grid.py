@@ -1,6 +1,5 @@
 import numpy as np
-import random
-import math
+import profiler as pf
 
 # Globals
 __gridSize__ = (900,900) 
@@ -8,62 +7,149 @@ __cellSize__ = 10
 __gridDim__ = tuple(map(lambda x: int(x/__cellSize__), __gridSize__))
 nx, ny = __gridDim__
 
+# Offsets reached from a cell in at most ws steps of the given offsets (cells of Grid.furtherNeighbours)
+def stencil(offsets: list, ws: int = 1) -> tuple:
+    further = set(offsets)
+    frontier = set(offsets)
+    for k in range(ws-1):
+        frontier = {(dx+ox, dy+oy) for (dx, dy) in frontier for (ox, oy) in offsets}
+        further |= frontier
+    return tuple(sorted(further))
+
+# Sums the plane values over the stencil of every cell (neighbours outside the grid are ignored).
+# The stencil applies to the last two axes, so stacked planes are summed in the same pass.
+# The sums are written in out when given, allocated otherwise.
+def convolve(plane, offsets: tuple, dtype='int32', out=None):
+    nx, ny = plane.shape[-2:]
+    sums = np.empty(plane.shape, dtype=dtype) if out is None else out
+    sums.fill(0)
+    for dx, dy in offsets:
+        # Cells (x, y) whose neighbour (x+dx, y+dy) lies in the grid
+        cells = (..., slice(max(0, -dx), nx - max(0, dx)), slice(max(0, -dy), ny - max(0, dy)))
+        neighbours = (..., slice(max(0, dx), nx - max(0, -dx)), slice(max(0, dy), ny - max(0, -dy)))
+        sums[cells] += plane[neighbours]
+    return sums
+
+# Tree plane with ratio*size trees of random age (from 1 to max_age). Trees falling on forbidden cells
+# (boolean mask) are planted back as young trees on free allowed cells, drawn without replacement.
+def plant(rng, ratio: float, shape: tuple, forbidden=None, max_age: int = 10):
+    size = shape[0] * shape[1]
+    trees = rng.integers(1, max_age + 1, size, dtype='uint8')
+    trees[:int((1-ratio)*size)] = 0
+    rng.shuffle(trees)
+
+    if forbidden is not None:
+        forbidden = np.asarray(forbidden, dtype=bool).ravel()
+        displaced = np.count_nonzero(trees[forbidden])
+        trees[forbidden] = 0
+        free = np.flatnonzero((trees == 0) & ~forbidden)
+        trees[rng.choice(free, min(displaced, len(free)), replace=False)] = 1
+    return trees.reshape(shape)
+
+# Stencil of a neighbourhood on a grid of a given shape, with its boundary-clipped variants
+class Neighbourhood:
+    _stencil = None
+    _shape = None
+    _reach = None
+    _variants = None
+    _cardinality = None
+
+    def __init__(self, offsets: list, ws: int, shape: tuple):
+        self._stencil = stencil(offsets, ws)
+        self._shape = shape
+        self._reach = max([max(abs(dx), abs(dy)) for (dx, dy) in self._stencil], default=0)
+        self._variants = {}
+
+    # Offsets of the stencil that stay in the grid from the cell (x, y), shared by all the cells
+    # at the same distance (up to the stencil reach) from each border
+    def variant(self, x: int, y: int) -> tuple:
+        r = self._reach
+        key = (min(x, r), min(self._shape[0] - 1 - x, r), min(y, r), min(self._shape[1] - 1 - y, r))
+        offsets = self._variants.get(key)
+        if offsets is None:
+            offsets = tuple((dx, dy) for (dx, dy) in self._stencil if -key[0] <= dx <= key[1] and -key[2] <= dy <= key[3])
+            self._variants[key] = offsets
+        return offsets
+
+    def indices(self, x: int, y: int) -> list:
+        return [(x+dx, y+dy) for (dx, dy) in self.variant(x, y)]
+
+    # Number of neighbours of every cell
+    def cardinality(self):
+        if self._cardinality is None:
+            self._cardinality = convolve(np.ones(self._shape, dtype='uint8'), self._stencil, dtype='uint8')
+        return self._cardinality
+
+# Planes packed in one uint8 block, with two buffers per plane (current and next state)
+class PlaneStore:
+    _block = None
+    _names = None
+
+    def __init__(self, names: list, shape: tuple):
+        self._names = list(names)
+        self._block = np.zeros((len(self._names), 2) + tuple(shape), dtype='uint8')
+
+    # Current and next state buffers of a plane
+    def buffers(self, name: str):
+        return self._block[self._names.index(name)]
+
+    # Memory used by the planes
+    def nbytes(self) -> int:
+        return self._block.nbytes
+
 class Grid:
     _grid = None
     _gridbis = None
     _indexVoisins = [(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)]
     
-    def __init__(self, empty=True, ratio=None, river=None, river_width=3, forbidden=None, clouds=None):
+    # buffers is the (2, nx, ny) uint8 block holding the current and next states, allocated if not given.
+    # rng is the numpy Generator placing the river and the trees, a new one if not given.
+    def __init__(self, empty=True, ratio=None, river=None, river_width=3, forbidden=None, clouds=None, shape=None,
+                 buffers=None, rng=None):
+
+        # Grid dimensions, __gridDim__ by default
+        if shape is None:
+            shape = __gridDim__
+        nx, ny = shape
+        if rng is None:
+            rng = np.random.default_rng()
         
         # Create an empty grid
         if empty:
-            self._grid = np.zeros(__gridDim__, dtype='int8')
-            self._gridbis = np.zeros(__gridDim__, dtype='int8')
+            self._grid = np.zeros(shape, dtype='uint8')
             
         # Create a grid with one horizontal river of river_width at y0
         elif river is not None:
-            self._grid = np.zeros(__gridDim__, dtype='int8')
-            self._gridbis = np.zeros(__gridDim__, dtype='int8')
+            self._grid = np.zeros(shape, dtype='uint8')
             
-            y0 = np.random.randint(25, 66)
-            
-            for x in range(nx):
-                for y in range(river_width):
+            # y0 in the middle of the grid (25 to 65 for 90 rows)
+            y0 = rng.integers(ny * 5 // 18, ny * 11 // 15)
 
-                    if river == "line":
-                        self._grid[x, y0 + y] = 1
-                    elif river == "sin":
-                        self._grid[x, int(y0 + y + math.sin(x))] = 1
+            # Rows y0 to y0 + river_width - 1 of every column, shifted by sin(x) for a sinuous river
+            xs = np.arange(nx)[:, None]
+            ys = y0 + np.arange(river_width)[None, :]
+            if river == "sin":
+                ys = (ys + np.sin(xs)).astype(int)
+            self._grid[xs, ys] = 1
 
+        # Create a grid with clouds at the coordinates (xs, ys)
         elif clouds is not None:
-            self._grid = np.zeros(__gridDim__, dtype='int8')
-
-            for x, y in clouds:
-                self._grid[x, y] = 1
+            self._grid = np.zeros(shape, dtype='uint8')
+            self._grid[clouds[0], clouds[1]] = 1
         
-        # Fill grid available space with ratio*size random values (from 1 to 10)
+        # Fill grid available space with ratio*size random values (from 1 to 10), forbidden being a boolean
+        # mask of the cells where no tree can grow
         else:
             assert(ratio is not None)
-            size = nx * ny             
-            self._grid = np.random.randint(1, 11, size)
-            self._grid[:int((1-ratio)*size)] = 0
-            np.random.shuffle(self._grid)
-            self._gridbis = np.reshape(self._grid, (nx, ny))
-            self._grid = np.reshape(self._grid, (nx, ny))
-            
-            if forbidden is not None:
-                for (x, y) in forbidden:
-                    self._grid[x, y] = 0
-                
-                # Free allowed positions in the grid according to the forbidden positions
-                allowed_free = [(x,y) for x in range(nx) for y in range(ny) if (x,y) not in forbidden
-                                                                                    and self._grid[x,y] == 0]
-                
-                for i in range(len(forbidden)):
-                    rnd_x, rnd_y = allowed_free[np.random.randint(0, len(allowed_free))]
-                    self._grid[rnd_x, rnd_y] = 1
-                
-        self._gridbis = self._grid
+            self._grid = plant(rng, ratio, shape, forbidden)
+
+        # Current state (_gridbis) and next state (_grid) are swapped after each update
+        if buffers is None:
+            buffers = np.zeros((2,) + tuple(shape), dtype='uint8')
+        buffers[0] = self._grid
+        buffers[1] = self._grid
+        self._gridbis = buffers[0]
+        self._grid = buffers[1]
                 
         assert (np.array_equal(self._grid, self._gridbis))
 
@@ -71,13 +157,15 @@ class Grid:
         self._indexVoisins = [(-1,-1),(-1,0),(-1,1),(0,-1),(0,1),(1,-1),(1,0),(1,1)]
 
     def indiceVoisins(self, x: int, y: int) -> list:
-        return [(dx+x,dy+y) for (dx,dy) in self._indexVoisins if dx+x >=0 and dx+x < __gridDim__[0] and dy+y>=0 
-                                                                        and dy+y < __gridDim__[1]] 
+        nx, ny = self._gridbis.shape
+        return [(dx+x,dy+y) for (dx,dy) in self._indexVoisins if dx+x >=0 and dx+x < nx and dy+y>=0 
+                                                                        and dy+y < ny] 
 
     def voisins(self,x: int, y: int) -> list:
         return [self._gridbis[vx,vy] for (vx,vy) in self.indiceVoisins(x,y)]
     
     # Returns the list of neighbours of the cell (x, y) depending on the wind strength ws
+    @pf.timed("neighbours")
     def furtherNeighbours(self, x: int, y: int, ws: int) -> list:
         neighbours = self.indiceVoisins(x, y)
         further_neighbours = neighbours.copy()
@@ -96,16 +184,57 @@ class Grid:
         return sum(self.voisins(x,y))
 
     def sumEnumerate(self) -> list:
-        return [(c, self.sommeVoisins(c[0], c[1])) for c, _ in np.ndenumerate(self._grid)]
+        sums = convolve(self._gridbis, tuple(self._indexVoisins))
+        return [(c, s) for c, s in np.ndenumerate(sums)]
+
+    # Stencil of the current neighbourhood expanded ws times
+    def stencil(self, ws: int = 1) -> tuple:
+        return stencil(self._indexVoisins, ws)
+
+    # Neighbourhood of the current neighbours expanded ws times
+    def neighbourhood(self, ws: int = 1) -> Neighbourhood:
+        return Neighbourhood(self._indexVoisins, ws, self._gridbis.shape[-2:])
+
+    # Values of the neighbours of the cell (x, y) in the given neighbourhood
+    @pf.timed("neighbours")
+    def neighbours(self, hood: Neighbourhood, x: int, y: int) -> list:
+        return [self._gridbis[x+dx, y+dy] for (dx, dy) in hood.variant(x, y)]
+
+    # Sum of the neighbour values and number of neighbours of every cell, for the given neighbourhood.
+    # The sums are written in out when given.
+    @pf.timed("neighbour sums")
+    def neighbourSums(self, hood: Neighbourhood = None, out=None) -> tuple:
+        if hood is None:
+            hood = self.neighbourhood()
+        return convolve(self._gridbis, hood._stencil, out=out), hood.cardinality()
 
     def drawMe(self):
         pass
     
+    # The next state becomes the current state (buffer swap, no copy)
+    @pf.timed("swap")
     def updateBis(self):
-        self._gridbis = np.copy(self._grid)
+        self._grid, self._gridbis = self._gridbis, self._grid
+
+    # Writes the current state shifted by (dx, dy) in the next state, wrapping around the grid (no allocation)
+    def shift(self, dx: int, dy: int):
+        nx, ny = self._gridbis.shape
+        dx %= nx
+        dy %= ny
+        self._grid[dx:, dy:] = self._gridbis[:nx-dx, :ny-dy]
+        self._grid[:dx, dy:] = self._gridbis[nx-dx:, :ny-dy]
+        self._grid[dx:, :dy] = self._gridbis[:nx-dx, ny-dy:]
+        self._grid[:dx, :dy] = self._gridbis[nx-dx:, ny-dy:]
+
+    # Starts the next state from the current one, for updates writing only the cells that change
+    @pf.timed("copy")
+    def copyToNext(self):
+        np.copyto(self._grid, self._gridbis)
     
+    # Reads the current state of a cell
     def __getitem__(self, key: tuple):
-        return self._grid[key[0], key[1]]
+        return self._gridbis[key[0], key[1]]
     
+    # Writes the next state of a cell
     def __setitem__(self, key: tuple, value: int):
         self._grid[key[0], key[1]] = value
\ No newline at end of file
@@ -0,0 +1,145 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import numpy as np
+import forest as ft
+import render as rd
+import stats as st
+import profiler as pf
+import trajectory as tj
+
+# Engine of the headless runs, the scalar engine of the interactive simulation being far too slow for long runs
+ENGINE = "numpy"
+# Delay between two GIF frames (ms)
+GIF_DURATION = 100
+
+def parse(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Runs a forest without display and exports its evolution")
+    parser.add_argument("--steps", type=int, default=100, help="number of updates of the forest")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random generators")
+    parser.add_argument("--shape", type=int, nargs=2, default=None, metavar=("NX", "NY"), help="size of the grid in cells")
+    parser.add_argument("--humidity", type=float, default=ft.HUMIDITY)
+    parser.add_argument("--lightning", type=float, default=ft.LIGHTNING)
+    parser.add_argument("--new-growth", type=float, default=ft.NEW_GROWTH)
+    parser.add_argument("--tree-ratio", type=float, default=ft.TREE_RATIO)
+    parser.add_argument("--river", choices=("line", "sin", "none"), default=ft.RIVER)
+    parser.add_argument("--river-width", type=int, default=ft.RIVER_WIDTH)
+    parser.add_argument("--clouds", type=int, default=ft.CLOUDS, help="number of clouds (0 for none)")
+    parser.add_argument("--wind", type=int, choices=sorted(ft.WINDS), default=ft.WIND)
+    parser.add_argument("--wind-strength", type=int, choices=range(ft.WIND_MAX + 1), default=ft.WIND_STRENGTH)
+    parser.add_argument("--engine", choices=("scalar", "numpy", "sparse", "jit"), default=ENGINE)
+
+    parser.add_argument("--counters", default=None, help="CSV file of the counters and events at every step ('-' for stdout)")
+    parser.add_argument("--frames", default=None, help="directory of the PNG frames")
+    parser.add_argument("--gif", default=None, help="animated GIF file (requires Pillow)")
+    parser.add_argument("--npz", default=None, help="compressed time series of the planes")
+    parser.add_argument("--trajectory", default=None, help="directory of the recorded states, replayed with scene.py")
+    parser.add_argument("--profile", default=None, help="CSV file of the timings of the update phases")
+    parser.add_argument("--every", type=int, default=1, help="record a frame every EVERY steps")
+    parser.add_argument("--scale", type=int, default=1, help="size of a cell in pixels in the PNG and GIF frames")
+    return parser.parse_args(argv)
+
+def config(args) -> ft.ForestConfig:
+    parameters = dict(humidity=args.humidity, lightning=args.lightning, new_growth=args.new_growth,
+                      tree_ratio=args.tree_ratio, river=None if args.river == "none" else args.river,
+                      river_width=args.river_width, clouds=args.clouds or None, wind=args.wind,
+                      wind_strength=args.wind_strength, engine=args.engine)
+    if args.shape is not None:
+        parameters["shape"] = tuple(args.shape)
+    return ft.ForestConfig(**parameters)
+
+# Image enlarged so that a cell takes scale x scale pixels
+def upscale(image, scale: int):
+    if scale == 1:
+        return image
+    return np.repeat(np.repeat(image, scale, axis=0), scale, axis=1)
+
+# Saves an RGB image indexed [x, y] as a PNG file, through pygame which needs no display for it
+def save_png(rgb, path: str):
+    import pygame
+    pygame.image.save(pygame.surfarray.make_surface(rgb), path)
+
+# Saves palette indices frames (indexed [x, y]) as an animated GIF. The images are only built while Pillow
+# writes them, so that only the small index frames are kept in memory.
+def save_gif(frames: list, palette, path: str, scale=1, duration=GIF_DURATION):
+    from PIL import Image
+    flat = palette.astype('uint8').ravel().tolist()
+
+    def image(indices):
+        img = Image.fromarray(np.ascontiguousarray(upscale(indices, scale).T), mode="P")
+        img.putpalette(flat)
+        return img
+
+    images = (image(indices) for indices in frames)
+    first = next(images)
+    first.save(path, save_all=True, append_images=images, duration=duration, loop=0, optimize=False)
+
+# Runs the forest and records what the arguments ask for, returns the number of steps per second
+def run(args) -> float:
+    pf.enabled = args.profile is not None
+    forest = ft.Forest(config(args), seed=args.seed)
+
+    counters = None
+    if args.counters is not None:
+        stream = sys.stdout if args.counters == "-" else open(args.counters, "w", newline="")
+        counters = csv.writer(stream)
+        counters.writerow(("step",) + st.Stats.HEADER)
+
+    if args.frames is not None:
+        os.makedirs(args.frames, exist_ok=True)
+    table, palette = rd.palette_table(forest._config.humidity)
+    gif = []
+    trajectory = tj.TrajectoryWriter(args.trajectory, forest) if args.trajectory is not None else None
+    series = {"steps": [], "trees": [], "burning": [], "clouds": [], "counters": [], "ages": [], "times": []}
+
+    def record(step: int):
+        stats = forest.stats()
+        if counters is not None:
+            counters.writerow((step,) + stats.row())
+        if step % args.every != 0:
+            return
+        if args.frames is not None:
+            save_png(upscale(rd.forest_colors(forest), args.scale), f"{args.frames}/frame_{step:06d}.png")
+        if args.gif is not None:
+            gif.append(rd.forest_indices(forest, table))
+        if trajectory is not None:
+            trajectory.append(forest, step)
+        if args.npz is not None:
+            series["steps"].append(step)
+            series["trees"].append(forest._trees._gridbis.copy())
+            series["burning"].append(forest._burning._gridbis.copy())
+            series["clouds"].append(forest._clouds._gridbis.copy())
+            series["counters"].append(stats.row())
+            series["ages"].append(stats.ages)
+            series["times"].append(stats.times)
+
+    start = time.perf_counter()
+    record(0)
+    for step in range(1, args.steps + 1):
+        forest.update()
+        forest.update_clouds()
+        record(step)
+    elapsed = time.perf_counter() - start
+
+    if counters is not None and args.counters != "-":
+        stream.close()
+    if trajectory is not None:
+        trajectory.close()
+    if args.profile is not None:
+        pf.dump_csv(args.profile)
+    if args.gif is not None:
+        save_gif(gif, palette, args.gif, args.scale)
+    if args.npz is not None:
+        np.savez_compressed(args.npz, water=forest._water._gridbis, config=json.dumps(vars(forest._config)),
+                            **{name: np.array(values) for name, values in series.items()})
+    return args.steps / elapsed if elapsed > 0 else float("inf")
+
+if __name__ == '__main__':
+    args = parse()
+    speed = run(args)
+    print(f"{args.steps} steps, {speed:.1f} steps/s", file=sys.stderr)
+    for phase, calls, mean, last, longest in pf.summary():
+        print(f"{phase}: {calls} calls, {mean * 1000:.3f} ms (max {longest * 1000:.3f} ms)", file=sys.stderr)
@@ -0,0 +1,145 @@
+import numpy as np
+import profiler as pf
+
+# Optional JIT compiler, the forest falls back to its NumPy engine without it
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# One update of the forest cell by cell with the exact rules of Forest.update, reading the previous planes and
+# writing the new ones. rnd holds the same two random fields as the NumPy engine (first and second draw of a cell).
+# The age and burning time histograms of the new planes are counted in ages and times (zeroed, max_age + 1 long).
+# Returns the number of cells of each event (in the order of stats.EVENTS).
+def _step(trees, burning, water, offsets, rnd, humidity, lightning, new_growth, max_age, new_trees, new_burning,
+          ages, times):
+    nx, ny = trees.shape
+    stop_drop = int(humidity * 10)
+    ignited = 0
+    struck = 0
+    grown = 0
+    died = 0
+    extinguished = 0
+    exposed = 0
+
+    for x in range(nx):
+        for y in range(ny):
+            age = trees[x, y]
+            fire = burning[x, y]
+            new_trees[x, y] = age
+            new_burning[x, y] = fire
+
+            # Nothing happens in water
+            if water[x, y] != 0:
+                ages[age] += 1
+                times[fire] += 1
+                continue
+
+            # Treatment for a burning tree: can stop burning, continue or die
+            if age > 0 and fire > 0:
+                if rnd[0, x, y] <= humidity:
+                    if fire - stop_drop <= 0:
+                        new_burning[x, y] = 0
+                        extinguished += 1
+                    else:
+                        new_burning[x, y] = fire - stop_drop
+                elif age > 1:
+                    new_trees[x, y] = age - 1
+                    new_burning[x, y] = fire + 1
+                else:
+                    new_trees[x, y] = 0
+                    new_burning[x, y] = 0
+                    died += 1
+
+            # Treatment for a non-burning tree: can ignite or grow older
+            elif age > 0:
+                total = 0
+                count = 0
+                for k in range(offsets.shape[0]):
+                    vx = x + offsets[k, 0]
+                    vy = y + offsets[k, 1]
+                    if vx >= 0 and vx < nx and vy >= 0 and vy < ny:
+                        total += burning[vx, vy]
+                        count += 1
+
+                if total > 0:
+                    exposed += 1
+                if count > 0 and rnd[0, x, y] < (1 - humidity) * total / count:
+                    new_burning[x, y] = 1
+                    ignited += 1
+                elif rnd[1, x, y] <= lightning:
+                    new_burning[x, y] = 1
+                    struck += 1
+                elif age < max_age:
+                    new_trees[x, y] = age + 1
+
+            # Treatment for an empty cell: can grow a new tree
+            elif rnd[0, x, y] <= new_growth * (1 + humidity * 10):
+                new_trees[x, y] = 1
+                grown += 1
+
+            ages[new_trees[x, y]] += 1
+            times[new_burning[x, y]] += 1
+
+    return ignited, struck, grown, died, extinguished, exposed
+
+# Compiled kernel, None when numba is not installed
+_jit_step = njit(cache=True, nogil=True)(_step) if njit is not None else None
+
+def available() -> bool:
+    return _jit_step is not None
+
+# Applies the evolution rules with the compiled kernel, same signature and result as forest.evolve
+# (the neighbourhood being given by its stencil offsets instead of its sums, without workspace), the histograms
+# being counted by the kernel along the update
+@pf.timed("rules")
+def evolve(trees, burning, water, offsets, rnd, humidity, lightning, new_growth, max_age, out=None, events=None,
+           histograms=None) -> tuple:
+    if out is None:
+        out = (np.empty_like(trees), np.empty_like(burning))
+    new_trees, new_burning = out
+    offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+    ages = np.zeros(max_age + 1, dtype=np.int64)
+    times = np.zeros(max_age + 1, dtype=np.int64)
+    ignited, struck, grown, died, extinguished, exposed = _jit_step(trees, burning, water, offsets, rnd, float(humidity),
+                                                                    float(lightning), float(new_growth), max_age,
+                                                                    new_trees, new_burning, ages, times)
+    if events is not None:
+        events.update(ignited=ignited, struck=struck, grown=grown, died=died, extinguished=extinguished, exposed=exposed)
+    if histograms is not None:
+        histograms.update(ages=ages, times=times)
+    d_tree = grown - died
+    return new_trees, new_burning, (d_tree, ignited + struck - extinguished - died, -d_tree)
+
+
+# Seeded equivalence check of the compiled kernel against the NumPy engine: both engines start from the same
+# forest and random generator state and draw the same random fields, so they must give the same planes and
+# counts at every step
+if __name__ == '__main__':
+    import forest as ft
+
+    if not available():
+        print("numba is not installed, the jit engine falls back to the numpy engine")
+
+    configs = [
+        ft.ForestConfig(),
+        ft.ForestConfig(humidity=0.35, lightning=0.001, new_growth=0.01, wind=2, wind_strength=2, tree_ratio=0.7),
+        ft.ForestConfig(humidity=0.1, lightning=0, new_growth=0, wind=3, wind_strength=3, river="sin", clouds=None),
+        ft.ForestConfig(humidity=0.8, lightning=0.01, new_growth=0.05, wind=4, wind_strength=1, shape=(120, 70)),
+    ]
+    for seed, config in enumerate(configs):
+        reference = ft.Forest(config.copy(engine="numpy"), seed=seed)
+        compiled = reference.copy()
+        compiled._config = config.copy(engine="jit")
+
+        for step in range(50):
+            reference.update()
+            compiled.update()
+
+            assert np.array_equal(reference._trees._gridbis, compiled._trees._gridbis), (seed, step)
+            assert np.array_equal(reference._burning._gridbis, compiled._burning._gridbis), (seed, step)
+            assert (reference._tree, reference._burnt, reference._empties) == (compiled._tree, compiled._burnt, compiled._empties)
+            assert reference.stats().events == compiled.stats().events, (seed, step)
+            assert np.array_equal(reference.stats().ages, compiled.stats().ages), (seed, step)
+            assert np.array_equal(reference.stats().times, compiled.stats().times), (seed, step)
+        print(f"{config}: identical over 50 steps")
@@ -2,40 +2,31 @@ import sys, math, random
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
-import forest as ft
+import sweep as sw
 
-if __name__ == '__main__':
+# Number of forests simulated for each density
+REPLICAS = 200
+SEED = 0
 
-    ft.LIGHTNING = 0
-    ft.NEW_GROWTH = 0
-    ft.WIND = 1
-    ft.WIND_STRENGTH = 1
-    ft.RIVER = None
-    ft.CLOUDS = None
+if __name__ == '__main__':
 
     densities = [d for d in np.arange(0.01, 1, 0.01)]
-    percentageBurnt = []
-
-    for density in densities:
-        ft.TREE_RATIO = density
-        forest = ft.Forest()
-
-        done = False       
-        while done == False:
-            
-            forest.update()
+    results = np.zeros((len(densities), REPLICAS))
+    remaining = [REPLICAS] * len(densities)
 
-            if forest._burnt == 0:
-                #print("No more burning trees")
-                done = True
-                continue
+    # Replicas of all the densities burn in parallel, a density is reported once all its replicas are done
+    for i, r, perc in sw.sweep(densities, REPLICAS, SEED, sw.PERCOLATION):
+        results[i, r] = perc
+        remaining[i] -= 1
+        if remaining[i] == 0:
+            print(f"For density {densities[i]:.2f}, {results[i].mean():.2f}% (+/- {results[i].std():.2f}) of the trees have burnt")
 
-        perc = (1 - (forest._tree / forest._init)) * 100
-        percentageBurnt.append(perc)
-        print(f"For density {density:.2f}, {perc:.2f}% of the trees have burnt")
+    percentageBurnt = results.mean(axis=1)
+    deviations = results.std(axis=1)
 
     plt.xlabel("Forest density")
     plt.ylabel("Percentage of trees burnt")
     plt.plot(densities, percentageBurnt)
+    plt.fill_between(densities, percentageBurnt - deviations, percentageBurnt + deviations, alpha=0.3)
     plt.show()
-    plt.savefig("./images/percolation.png")
\ No newline at end of file
+    plt.savefig("./images/percolation.png")
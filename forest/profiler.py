@@ -0,0 +1,58 @@
+import collections
+import csv
+import functools
+import time
+
+# Timers are off by default: a timed function then only checks this flag before running
+enabled = False
+# Number of timings kept for each phase (older ones are dropped)
+CAPACITY = 1000
+
+# Ring buffer of (call number, duration in seconds) of each phase, and number of calls of each phase
+_timings = {}
+_calls = collections.Counter()
+
+def record(phase: str, seconds: float):
+    _calls[phase] += 1
+    if phase not in _timings:
+        _timings[phase] = collections.deque(maxlen=CAPACITY)
+    _timings[phase].append((_calls[phase], seconds))
+
+# Decorator timing every call of a function as the given phase while the timers are enabled.
+# Phases can be nested, the time of a phase includes the phases it calls.
+def timed(phase: str):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(phase, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def reset():
+    _timings.clear()
+    _calls.clear()
+
+# (phase, calls, mean, last and max duration in seconds over the kept timings) of every phase,
+# the phases taking the most time first
+def summary() -> list:
+    rows = []
+    for phase, timings in list(_timings.items()):
+        # Copied first (in one call) since the simulation thread may be recording timings
+        durations = [seconds for _, seconds in list(timings)]
+        rows.append((phase, _calls[phase], sum(durations) / len(durations), durations[-1], max(durations)))
+    return sorted(rows, key=lambda row: row[2] * row[1], reverse=True)
+
+# Writes the kept timings as (phase, call, seconds) rows
+def dump_csv(path: str):
+    with open(path, "w", newline="") as stream:
+        writer = csv.writer(stream)
+        writer.writerow(("phase", "call", "seconds"))
+        for phase, timings in list(_timings.items()):
+            for call, seconds in list(timings):
+                writer.writerow((phase, call, seconds))
@@ -0,0 +1,56 @@
+import numpy as np
+import forest as ft
+
+# Colors
+WATER_COLOR = (50, 50, 255)
+
+# Cell codes indexing the color table: 0 = empty, 1-127 = tree age, 128-254 = burning time (+128), 255 = water
+BURNING_CODE = 128
+WATER_CODE = 255
+
+# Color table of the cell codes, without (first row) and under (second row) a cloud
+def color_table(humidity: float):
+    table = np.zeros((2, 256, 3))
+    codes = np.arange(256)
+
+    # Color according to the tree's age
+    table[0, 1:BURNING_CODE, 1] = 255 - codes[1:BURNING_CODE] * 155 / 9
+    # Burning tree, color according to burning time
+    table[0, BURNING_CODE:WATER_CODE, 0] = 255
+    table[0, BURNING_CODE:WATER_CODE, 1] = 165 - (codes[BURNING_CODE:WATER_CODE] - BURNING_CODE) * 120 / 9
+    table[0, 0] = ft.humidity_color(humidity)
+    table[0, WATER_CODE] = WATER_COLOR
+
+    # Clouds darken the cells below
+    table[1] = table[0] - ft.COLOR_CLOUDS
+    return np.clip(table, 0, 255).astype('uint8')
+
+# Code of every cell
+def cell_codes(trees, burning, water):
+    codes = np.where(burning > 0, BURNING_CODE + np.minimum(burning, WATER_CODE - BURNING_CODE - 1), np.minimum(trees, BURNING_CODE - 1))
+    codes = np.where(trees > 0, codes, 0)
+    return np.where(water > 0, WATER_CODE, codes).astype('uint8')
+
+# RGB image of the planes, one pixel per cell, indexed [x, y] like the planes (surfarray layout)
+def colors(trees, burning, water, clouds, humidity: float):
+    return color_table(humidity)[np.minimum(clouds, 1), cell_codes(trees, burning, water)]
+
+# RGB image of the current state of a forest
+def forest_colors(forest):
+    return colors(forest._trees._gridbis, forest._burning._gridbis, forest._water._gridbis,
+                  forest._clouds._gridbis, forest._config.humidity)
+
+# RGB image of a snapshot of a forest
+def snapshot_colors(snapshot):
+    return colors(snapshot._trees, snapshot._burning, snapshot._water, snapshot._clouds, snapshot._config.humidity)
+
+# Indexed version of the color table for palette images (GIF): (2, 256) table of palette indices and the
+# (colors, 3) palette, the table having far fewer distinct colors than the 256 a palette can hold
+def palette_table(humidity: float) -> tuple:
+    palette, indices = np.unique(color_table(humidity).reshape(-1, 3), axis=0, return_inverse=True)
+    return indices.reshape(2, 256).astype('uint8'), palette
+
+# Palette indices of the current state of a forest, indexed [x, y] like the planes
+def forest_indices(forest, table):
+    return table[np.minimum(forest._clouds._gridbis, 1),
+                 cell_codes(forest._trees._gridbis, forest._burning._gridbis, forest._water._gridbis)]
@@ -1,3 +1,4 @@
+import sys
 import pygame
 import pygame.draw
 import input_box as ibox
@@ -5,18 +6,31 @@ import input_button as ibut
 import numpy as np
 
 import forest as ft
+import render as rd
+import simulation as sim
+import trajectory as tj
+import profiler as pf
 
 
 # Globals
 
-__clock_tick__ = 2
+# Frames drawn per second
+__clock_tick__ = 30
+# Simulation steps per second (None: as fast as possible)
+__steps_per_second__ = 2
 __screenSize__ = (1250,900)
-WATER_COLOR = (50, 50, 255)
+# Forest rendering: surface (color table and one scaled blit) or cells (one draw call per cell)
+__renderer__ = "surface"
+# Above this number of changed cells, the surface renderer redraws the whole forest instead of the changed cells
+__dirty_limit__ = 2000
+# Phases shown by the timing overlay (F2 turns the timers on and off)
+__profile_lines__ = 8
+WATER_COLOR = rd.WATER_COLOR
 COLOR_EMPTY = (255, 255, 255)
 
 
 # Get the right color for a given cell
-def getColorCell(cell: tuple) -> tuple:
+def getColorCell(cell: tuple, humidity=None) -> tuple:
     # The cell contains water
     if cell[2]:
         return WATER_COLOR
@@ -36,27 +50,49 @@ def getColorCell(cell: tuple) -> tuple:
 
     # The cell is empty
     else:
-        return ft.humidity_color()
+        return ft.humidity_color(humidity)
 
 class Scene:
     _mouseCoords = (0,0)
     _forest = None
+    _simulation = None
+    _snapshot = None
+    _config = None
+    _pushed = None
     _font = None
+    _small_font = None
     _input_boxes = {}
     _wind_buttons = {}
     _ws_buttons = {}
+    _cells = None
 
-    def __init__(self):
+    # Last rendered forest colors and legend state, for incremental redraw
+    _last_colors = None
+    _last_legend = None
+
+    # A recorded trajectory (directory written by trajectory.TrajectoryWriter) is replayed instead of a new forest
+    def __init__(self, config=None, trajectory=None):
         pygame.init()
         self._screen = pygame.display.set_mode(__screenSize__)
         self._font = pygame.font.SysFont('Arial',20)
-        self._forest = ft.Forest()
+        self._small_font = pygame.font.SysFont('Arial',14)
+
+        # The forest is updated by the simulation thread (or replayed), the scene draws its snapshots
+        # and keeps its own copy of the parameters edited in the interface
+        if trajectory is not None:
+            self._simulation = tj.Replay(tj.Trajectory(trajectory), __steps_per_second__)
+        else:
+            self._forest = ft.Forest(config)
+            self._simulation = sim.Simulation(self._forest, __steps_per_second__)
+        self._snapshot = self._simulation.snapshot()
+        self._config = self._snapshot._config.copy()
+        config = self._config
 
         # input boxes for parameters
-        self._input_boxes["humidity"] = ibox.InputBox(920, 465, 100, 30, self._screen, ft.HUMIDITY * 100, 100, 0.0, float, increment=1, decimals=1)
-        self._input_boxes["lightning"] = ibox.InputBox(920, 525, 100, 30, self._screen, ft.LIGHTNING * 100, 100, 0.0, float, increment=0.001, decimals=3)
-        self._input_boxes["new_growth"] = ibox.InputBox(920, 585, 100, 30, self._screen, ft.NEW_GROWTH * 100, 100, 0.0, float, increment=0.1, decimals=1)
-        self._input_boxes["wind_strength"] = ibox.InputBox(1110, 720, 25, 30, self._screen, ft.WIND_STRENGTH, ft.WIND_MAX, 0, int, min_width=25, writeable=False)
+        self._input_boxes["humidity"] = ibox.InputBox(920, 465, 100, 30, self._screen, config.humidity * 100, 100, 0.0, float, increment=1, decimals=1)
+        self._input_boxes["lightning"] = ibox.InputBox(920, 525, 100, 30, self._screen, config.lightning * 100, 100, 0.0, float, increment=0.001, decimals=3)
+        self._input_boxes["new_growth"] = ibox.InputBox(920, 585, 100, 30, self._screen, config.new_growth * 100, 100, 0.0, float, increment=0.1, decimals=1)
+        self._input_boxes["wind_strength"] = ibox.InputBox(1110, 720, 25, 30, self._screen, config.wind_strength, ft.WIND_MAX, 0, int, min_width=25, writeable=False)
 
         # buttons for wind direction
         self._wind_buttons["none"] = ibut.InputButton(1120, 650, 15, 15, self._screen, active=True)
@@ -69,29 +105,34 @@ class Scene:
         self._ws_buttons["minus"] = ibut.InputButton(1080, 725, 20, 20, self._screen, text="-", blink=True)
         self._ws_buttons["plus"] = ibut.InputButton(1145, 725, 20, 20, self._screen, text="+", blink=True)
 
+    @pf.timed("draw clouds")
     def draw_clouds(self):
-        if self._forest._clouds is not None:
-            for x in range(ft.gr.nx):
-                for y in range(ft.gr.ny):
-                    if self._forest._clouds[x, y]:
-                        color = ft.clouds_color(ft.humidity_color())
+        if self._snapshot._clouds is not None:
+            nx, ny = self._snapshot._config.shape
+            for x in range(nx):
+                for y in range(ny):
+                    if self._snapshot._clouds[x, y]:
+                        color = ft.clouds_color(ft.humidity_color(self._snapshot._config.humidity))
                         pygame.draw.circle(self._screen, color, 
                                         (x*ft.gr.__cellSize__  + 5, y*ft.gr.__cellSize__ +5), ft.gr.__cellSize__ *0.7)
 
 
+    @pf.timed("draw background")
     def draw_background(self):
         self._screen.fill((255,255,255))
-        pygame.draw.rect(self._screen, ft.humidity_color(), (0, 0, ft.gr.__gridSize__[0], ft.gr.__gridSize__[1]))
+        pygame.draw.rect(self._screen, ft.humidity_color(self._snapshot._config.humidity), (0, 0, ft.gr.__gridSize__[0], ft.gr.__gridSize__[1]))
 
     # Metho drawing actual forest simulation on the scene 
+    @pf.timed("draw cells")
     def draw_cells(self):
-        if self._forest._trees is None or self._forest._burning is None:
+        if self._snapshot._trees is None or self._snapshot._burning is None:
             return
         
-        for x in range(ft.gr.nx):
-            for y in range(ft.gr.ny):
+        nx, ny = self._snapshot._config.shape
+        for x in range(nx):
+            for y in range(ny):
                 
-                cell = self._forest.getCell(x,y)
+                cell = self._snapshot.getCell(x,y)
                 if cell[2]:
                     color = WATER_COLOR
                     if cell[3]:
@@ -99,13 +140,80 @@ class Scene:
                     pygame.draw.rect(self._screen, color, 
                                         (x*ft.gr.__cellSize__, y*ft.gr.__cellSize__, ft.gr.__cellSize__, ft.gr.__cellSize__))
                 elif cell[0]:
-                    color = getColorCell(cell)
+                    color = getColorCell(cell, self._snapshot._config.humidity)
                     if cell[3]:
                         color = ft.clouds_color(color)                    
                     pygame.draw.circle(self._screen, color, 
                                         (x*ft.gr.__cellSize__ + 5, y*ft.gr.__cellSize__ + 5), ft.gr.__cellSize__/2)
 
 
+    # Method drawing the forest as one image: one pixel per cell, scaled to the grid area
+    @pf.timed("draw surface")
+    def draw_surface(self, colors=None):
+        if self._cells is None or self._cells.get_size() != self._snapshot._config.shape:
+            self._cells = pygame.Surface(self._snapshot._config.shape)
+        if colors is None:
+            colors = rd.snapshot_colors(self._snapshot)
+
+        pygame.surfarray.blit_array(self._cells, colors)
+        self._screen.blit(pygame.transform.scale(self._cells, self.forest_size()), (0, 0))
+
+    # Size in pixels of a cell (a whole number so that cells can be redrawn one by one), 0 if cells are smaller than a pixel
+    def cell_size(self) -> int:
+        nx, ny = self._snapshot._config.shape
+        return min(ft.gr.__gridSize__[0] // nx, ft.gr.__gridSize__[1] // ny)
+
+    # Size in pixels of the drawn forest
+    def forest_size(self) -> tuple:
+        size = self.cell_size()
+        if size == 0:
+            return ft.gr.__gridSize__
+        return (self._snapshot._config.shape[0] * size, self._snapshot._config.shape[1] * size)
+
+    # Method redrawing only the cells whose color changed since the last frame, returns the updated rects
+    @pf.timed("draw forest")
+    def draw_forest_changes(self) -> list:
+        colors = rd.snapshot_colors(self._snapshot)
+        last = self._last_colors
+        self._last_colors = colors
+        size = self.cell_size()
+
+        if last is not None and last.shape == colors.shape and size > 0:
+            xs, ys = np.nonzero(np.any(colors != last, axis=2))
+            if len(xs) <= __dirty_limit__:
+                return [self._screen.fill(color, (x * size, y * size, size, size))
+                        for x, y, color in zip(xs.tolist(), ys.tolist(), colors[xs, ys].tolist())]
+
+        # Too many changes (or first frame): the whole forest is drawn again, and the legend with it since its border overlaps the forest
+        self._last_legend = None
+        pygame.draw.rect(self._screen, ft.humidity_color(self._snapshot._config.humidity), (0, 0, ft.gr.__gridSize__[0], ft.gr.__gridSize__[1]))
+        self.draw_surface(colors)
+        return [pygame.Rect(0, 0, ft.gr.__gridSize__[0], ft.gr.__gridSize__[1])]
+
+    # Everything shown in the legend panel
+    def legend_state(self) -> tuple:
+        snapshot = self._snapshot
+        events = tuple(snapshot._stats.events.values()) if snapshot._stats is not None else None
+        return ((snapshot._step, snapshot._tree, snapshot._burnt, snapshot._empties, events), tuple(vars(self._config).values()),
+                tuple((box.text, box.active, box.rect.w) for box in self._input_boxes.values()),
+                tuple((but.active, but.color) for but in list(self._wind_buttons.values()) + list(self._ws_buttons.values())),
+                self.profile_lines())
+
+    # Method redrawing the legend panel (texts, boxes and buttons) only when its content changed, returns the updated rects
+    @pf.timed("draw legend")
+    def draw_legend_changes(self) -> list:
+        state = self.legend_state()
+        if state == self._last_legend:
+            return []
+
+        panel = pygame.Rect(ft.gr.__gridSize__[0] - 1, 0, __screenSize__[0] - ft.gr.__gridSize__[0] + 1, __screenSize__[1])
+        self._screen.fill((255, 255, 255), panel)
+        self.draw_legend()
+        self.draw_boxes_buttons()
+        # Blinking buttons are released when drawn
+        self._last_legend = self.legend_state()
+        return [panel]
+
     def draw_text(self, text: str, position: tuple, color=(0,0,0)):
         self._screen.blit(self._font.render(text,1,color),position)
 
@@ -115,7 +223,9 @@ class Scene:
         self.draw_text(name + " (" + str(int(elem)) + " / " + str(np.round(1.*elem/total * 100, 2)) + "% of cells)", (x + 40, y))
     
     def draw_legend(self):
-        total = ft.gr.nx * ft.gr.ny 
+        config = self._config
+        snapshot = self._snapshot
+        total = config.shape[0] * config.shape[1]
 
         # Legend
         pygame.draw.line(self._screen, (0, 0, 0), (900, 0), (900, 1200), width=3)
@@ -132,19 +242,26 @@ class Scene:
         pygame.draw.rect(self._screen, (0, 0, 0), (920, 140, 20, 20), 2)
         
         # Text en measures
-        self.draw_text("Trees (" + str(int(self._forest._tree)) + " / " + str(np.round(1.*self._forest._tree/total * 100, 2)) + "% of cells)", (960, 100))
-        self.draw_text("Burning trees (" + str(int(self._forest._burnt)) + " / " + str(np.round(1.*self._forest._burnt/self._forest._tree * 100, 2)) + "% of trees)", (960, 140))
+        self.draw_text("Trees (" + str(int(snapshot._tree)) + " / " + str(np.round(1.*snapshot._tree/total * 100, 2)) + "% of cells)", (960, 100))
+        self.draw_text("Burning trees (" + str(int(snapshot._burnt)) + " / " + str(np.round(1.*snapshot._burnt/snapshot._tree * 100, 2)) + "% of trees)", (960, 140))
         
         # Legend for empty cells
-        self.draw_element("Empty cell", self._forest._empties, total, 920, 180, 20, 20, ft.humidity_color())
+        self.draw_element("Empty cell", snapshot._empties, total, 920, 180, 20, 20, ft.humidity_color(config.humidity))
         pygame.draw.rect(self._screen, (50, 50, 255), (920, 220, 20, 20))
         pygame.draw.rect(self._screen, (0, 0, 0), (920, 220, 20, 20), 2)
         self.draw_text("Water", (960, 220))
+
+        # Statistics of the last step (not recorded in a replay)
+        if snapshot._stats is not None:
+            events = snapshot._stats.events
+            self.draw_text("Fire front: " + str(events["exposed"]) + " trees exposed", (920, 260))
+            self.draw_text("Ignitions: " + str(events["ignited"]) + " by neighbours, " + str(events["struck"]) + " by lightning", (920, 290))
+            self.draw_text("Burnt down: " + str(events["died"]) + ", new trees: " + str(events["grown"]), (920, 320))
         
         # Parameters
-        self.draw_text("Initial tree rate: " + str(ft.TREE_RATIO*100) + "%", (920, 400))
+        self.draw_text("Initial tree rate: " + str(config.tree_ratio*100) + "%", (920, 400))
 
-        pygame.draw.rect(self._screen, ft.humidity_color(), (920, 440, 20, 20))
+        pygame.draw.rect(self._screen, ft.humidity_color(config.humidity), (920, 440, 20, 20))
         pygame.draw.rect(self._screen, (0, 0, 0), (920, 440, 20, 20), 2)
         self.draw_text("Humidity rate (%): ", (950, 440))
         self.draw_text("Lightning probability (%): ", (920, 500))
@@ -152,6 +269,24 @@ class Scene:
         self.draw_text("Wind direction: ", (920, 645))
         self.draw_text("Wind strength [0-" + str(ft.WIND_MAX) + "]:" , (920, 722))
 
+        # Timing overlay, when the timers are on
+        for i, line in enumerate(self.profile_lines()):
+            position = (920 + (i // 4) * 165, 828 + (i % 4) * 17)
+            self._screen.blit(self._small_font.render(line, 1, (0, 0, 0)), position)
+
+        # Step, with the length of the run when it is a replay
+        if isinstance(self._simulation, tj.Replay):
+            self.draw_text("Step " + str(snapshot._step) + " / " + str(self._simulation.last_step()) + " (left/right to move)", (920, 800))
+        else:
+            self.draw_text("Step " + str(snapshot._step), (920, 800))
+
+    # Mean time of the slowest phases, while the timers are on
+    def profile_lines(self) -> tuple:
+        if not pf.enabled:
+            return ()
+        rows = pf.summary()[:__profile_lines__]
+        return tuple(phase + ": " + str(round(mean * 1000, 1)) + " ms" for phase, calls, mean, last, longest in rows)
+
     def draw_boxes_buttons(self):
         for box in self._input_boxes.values():
             box.draw()
@@ -160,15 +295,36 @@ class Scene:
         for but in self._ws_buttons.values():
             but.draw()
 
-    # Display all the elements of the screen
-    def draw(self):
+    # Display all the elements of the screen, from the latest snapshot of the simulation.
+    # Returns the rects of the screen that changed.
+    @pf.timed("draw")
+    def draw(self) -> list:
+        self._snapshot = self._simulation.snapshot()
+
+        # Only the changed cells and the legend when it changed are drawn again
+        if __renderer__ == "surface":
+            return self.draw_forest_changes() + self.draw_legend_changes()
+
         self.draw_background()
         self.draw_clouds()
         self.draw_cells()
         self.draw_legend()
         self.draw_boxes_buttons()
+        return [self._screen.get_rect()]
 
     def handle_event(self, event):
+        # F2 turns the timers on and off
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F2:
+            pf.enabled = not pf.enabled
+            pf.reset()
+            return
+
+        # A replay is moved with the arrows (10 records with shift)
+        if isinstance(self._simulation, tj.Replay) and event.type == pygame.KEYDOWN and event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+            move = 10 if event.mod & pygame.KMOD_SHIFT else 1
+            self._simulation.move(move if event.key == pygame.K_RIGHT else -move)
+            return
+
         # Handle the event for all the input boxes and buttons
 
         for box in self._input_boxes.values():
@@ -180,6 +336,7 @@ class Scene:
 
     # Updates the wind according to the UI  
     def update_wind_dir(self):
+        config = self._config
     
         # List of the states of each wind button
         states = [button.active for button in self._wind_buttons.values()]
@@ -188,58 +345,63 @@ class Scene:
         for index, state in enumerate(states):
             
             if state:
-                ft.WIND = index
+                config.wind = index
                 if index != 0:
-                    if ft.WIND_STRENGTH == 0:
-                        ft.WIND_STRENGTH = 1
+                    if config.wind_strength == 0:
+                        config.wind_strength = 1
                 else:
-                    ft.WIND_STRENGTH = 0
+                    config.wind_strength = 0
 
-                self._input_boxes["wind_strength"].updateText(ft.WIND_STRENGTH)
+                self._input_boxes["wind_strength"].updateText(config.wind_strength)
                 return
 
     # Updates the wind strength according to the button clicked
     def update_wind_strength(self):
+        config = self._config
 
-        if ft.WIND != 0:
+        if config.wind != 0:
 
             for key in self._ws_buttons.keys():
 
                 if self._ws_buttons[key].active:
-                    if key == "minus" and ft.WIND_STRENGTH > 0:
-                        ft.WIND_STRENGTH -= 1
-                        if ft.WIND_STRENGTH == 0:
+                    if key == "minus" and config.wind_strength > 0:
+                        config.wind_strength -= 1
+                        if config.wind_strength == 0:
                             self._wind_buttons["none"].activate(self._wind_buttons)
-                    elif key == "plus" and ft.WIND_STRENGTH < ft.WIND_MAX:
-                        ft.WIND_STRENGTH += 1
+                    elif key == "plus" and config.wind_strength < ft.WIND_MAX:
+                        config.wind_strength += 1
 
-                    self._input_boxes["wind_strength"].updateText(ft.WIND_STRENGTH)
+                    self._input_boxes["wind_strength"].updateText(config.wind_strength)
         
     def update(self):
-        # Update the state of the forest
-        self._forest.update()
-
-        # Check which wind button is active and update the wind parameters accordingly     
+        # Check which wind button is active and update the wind parameters accordingly
         self.update_wind_dir()
         self.update_wind_strength()
 
-        # Update the position of the clouds
-        self._forest.update_clouds()
+        # Send the parameters that changed to the simulation
+        config = self._config
+        parameters = {"humidity": config.humidity, "lightning": config.lightning, "new_growth": config.new_growth,
+                      "wind": config.wind, "wind_strength": config.wind_strength}
+        if parameters != self._pushed:
+            self._simulation.set(**parameters)
+            self._pushed = parameters
         
 
 if __name__ == '__main__':
 
-    scene = Scene()
+    # python scene.py [trajectory directory to replay]
+    scene = Scene(trajectory=sys.argv[1] if len(sys.argv) > 1 else None)
     done = False
     clock = pygame.time.Clock()
 
+    # The forest is updated in the background
+    scene._simulation.start()
+
     # Main loop
     while done == False:
 
-        # Draw the elements of the screen
-        scene.draw()
-        # Display the entire screen
-        pygame.display.flip()
+        # Draw the elements of the screen and display the parts that changed
+        pygame.display.update(scene.draw())
     
         clock.tick(__clock_tick__)
 
@@ -259,15 +421,17 @@ if __name__ == '__main__':
            box.update()
 
         
-        # Update the forest global variables from the content of the input boxes
-        ft.HUMIDITY = scene._input_boxes["humidity"].try_except_cast() / 100
-        ft.LIGHTNING = scene._input_boxes["lightning"].try_except_cast() / 100
-        ft.NEW_GROWTH = scene._input_boxes["new_growth"].try_except_cast() / 100
-        ft.WIND_STRENGTH = scene._input_boxes["wind_strength"].try_except_cast()
+        # Update the forest parameters from the content of the input boxes
+        config = scene._config
+        config.humidity = scene._input_boxes["humidity"].try_except_cast() / 100
+        config.lightning = scene._input_boxes["lightning"].try_except_cast() / 100
+        config.new_growth = scene._input_boxes["new_growth"].try_except_cast() / 100
+        config.wind_strength = scene._input_boxes["wind_strength"].try_except_cast()
        
-       # Update the state of the forest
+        # Send the parameters to the simulation
         scene.update()
 
 
+    scene._simulation.stop()
     pygame.quit()
         
\ No newline at end of file
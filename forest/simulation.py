@@ -0,0 +1,116 @@
+import threading
+import queue
+import time
+import forest as ft
+
+# Read-only copy of the state of a forest after a given step
+class Snapshot:
+
+    # Planes
+    _trees = None
+    _burning = None
+    _water = None
+    _clouds = None
+
+    # Element counts and parameters
+    _tree = None
+    _burnt = None
+    _empties = None
+    _stats = None
+    _config = None
+    _step = None
+
+    # water is shared with the previous snapshot since it never changes
+    def __init__(self, forest, step: int, water=None):
+        self._trees = self.freeze(forest._trees._gridbis.copy())
+        self._burning = self.freeze(forest._burning._gridbis.copy())
+        self._clouds = self.freeze(forest._clouds._gridbis.copy())
+        self._water = water if water is not None else self.freeze(forest._water._gridbis.copy())
+        self._tree = forest._tree
+        self._burnt = forest._burnt
+        self._empties = forest._empties
+        self._stats = forest.stats()
+        self._config = forest._config.copy()
+        self._step = step
+
+    # Snapshot of planes that do not come from a forest (recorded trajectory), counters being (trees, burning, empties)
+    @classmethod
+    def from_planes(cls, trees, burning, water, clouds, counters: tuple, config, step: int):
+        snapshot = cls.__new__(cls)
+        snapshot._trees, snapshot._burning, snapshot._water, snapshot._clouds = map(cls.freeze, (trees, burning, water, clouds))
+        snapshot._tree, snapshot._burnt, snapshot._empties = counters
+        snapshot._config = config.copy()
+        snapshot._step = step
+        return snapshot
+
+    @staticmethod
+    def freeze(plane):
+        plane.flags.writeable = False
+        return plane
+
+    # Get state of a cell i.e (tree?, burning?, water?, cloud?)
+    def getCell(self, x: int, y: int) -> tuple:
+        return (int(self._trees[x, y]), int(self._burning[x, y]), int(self._water[x, y]), int(self._clouds[x, y]))
+
+# Thread updating a forest on its own, publishing a snapshot after each step.
+# Parameter changes are queued by the UI and applied between two steps.
+class Simulation(threading.Thread):
+
+    _forest = None
+    _snapshot = None
+    _steps_per_second = None
+
+    def __init__(self, forest, steps_per_second=None):
+        super().__init__(daemon=True)
+        self._forest = forest
+        self._steps_per_second = steps_per_second
+        self._snapshot = Snapshot(forest, 0)
+        self._changes = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    # Queues parameter changes (ForestConfig attributes), applied before the next step
+    def set(self, **parameters):
+        self._changes.put(parameters)
+
+    # Latest published state
+    def snapshot(self) -> Snapshot:
+        with self._lock:
+            return self._snapshot
+
+    def stop(self):
+        self._stopped.set()
+
+    def apply_changes(self):
+        config = self._forest._config
+        wind = (config.wind, config.wind_strength)
+        while True:
+            try:
+                parameters = self._changes.get_nowait()
+            except queue.Empty:
+                break
+            for name, value in parameters.items():
+                setattr(config, name, value)
+
+        # Drop the neighbourhoods of the previous wind when it changes
+        if (config.wind, config.wind_strength) != wind:
+            ft.evict_neighbourhoods(*wind)
+
+    # One step: forest and clouds update, then publication of the new state
+    def step(self):
+        self.apply_changes()
+        self._forest.update()
+        self._forest.update_clouds()
+
+        snapshot = Snapshot(self._forest, self._snapshot._step + 1, self._snapshot._water)
+        with self._lock:
+            self._snapshot = snapshot
+
+    def run(self):
+        while not self._stopped.is_set():
+            start = time.perf_counter()
+            self.step()
+
+            # Throttle the simulation if a speed is given, as fast as possible otherwise
+            if self._steps_per_second:
+                self._stopped.wait(max(0, 1 / self._steps_per_second - (time.perf_counter() - start)))
@@ -0,0 +1,45 @@
+import numpy as np
+
+# Events counted by the update of a forest:
+# ignited (by burning neighbours), struck (by lightning), grown (new trees), died (fully burnt trees),
+# extinguished (trees that stopped burning) and exposed (non-burning trees with a burning neighbour: the fire front)
+EVENTS = ("ignited", "struck", "grown", "died", "extinguished", "exposed")
+
+# Number of cells of each value of a plane, for the values 0 to length - 1
+def histogram(plane, length: int):
+    return np.bincount(plane.ravel(), minlength=length)
+
+# Statistics of a forest after an update, produced by the update itself
+class Stats:
+
+    # Exact element counts
+    trees = None
+    burning = None
+    empties = None
+
+    # Histograms: ages[a] is the number of cells holding a tree of age a, times[t] the number of cells
+    # burning for t steps (index 0 counting the cells without tree, or not burning)
+    ages = None
+    times = None
+
+    # Number of cells of each event during the update (stats.EVENTS)
+    events = None
+
+    # Columns of a row of statistics
+    HEADER = ("trees", "burning", "empties") + EVENTS
+
+    def __init__(self, trees: int, burning: int, empties: int, ages, times, events: dict):
+        self.trees = trees
+        self.burning = burning
+        self.empties = empties
+        self.ages = ages
+        self.times = times
+        self.events = events
+
+    # Counts and events as a flat row (HEADER), for the CSV outputs
+    def row(self) -> tuple:
+        return (self.trees, self.burning, self.empties) + tuple(self.events[name] for name in EVENTS)
+
+    def __repr__(self):
+        events = ", ".join(f"{name}={self.events[name]}" for name in EVENTS)
+        return f"Stats(trees={self.trees}, burning={self.burning}, empties={self.empties}, {events})"
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+import forest as ft
+import batch as bt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Parameters of a percolation run
+PERCOLATION = ft.ForestConfig(humidity=0.0, lightning=0, new_growth=0, wind=1, wind_strength=1, river=None, clouds=None)
+
+# Replicas burnt together by a job
+CHUNK = 25
+
+# Seed of the replica r of the density of index i: only depends on the master seed and (i, r),
+# so the results do not depend on the chunking nor on the order in which jobs complete
+def replica_seed(master: int, i: int, r: int) -> np.random.SeedSequence:
+    return np.random.SeedSequence(master, spawn_key=(i, r))
+
+# Burns the replicas of one density and returns the percentage of trees burnt in each of them.
+# The parameters come with the job as a ForestConfig.
+def burn(job: tuple) -> tuple:
+    i, density, replicas, master, config = job
+    forests = bt.ForestBatch([density] * len(replicas), config, seeds=[replica_seed(master, i, r) for r in replicas])
+    forests.run()
+    return i, replicas, forests.percentageBurnt()
+
+# Fans the (density, replicas, seed) jobs out over a process pool and yields
+# (density index, replica, percentage burnt) as the jobs complete
+def sweep(densities: list, replicas: int, master=0, config=PERCOLATION, workers=None, chunk=CHUNK):
+    jobs = [(i, density, list(range(r, min(r + chunk, replicas))), master, config)
+            for i, density in enumerate(densities) for r in range(0, replicas, chunk)]
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(burn, job) for job in jobs]
+        for future in as_completed(futures):
+            i, done, percentages = future.result()
+            for r, perc in zip(done, percentages):
+                yield i, r, perc
+
+# Percentage burnt of every (density, replica), as a (densities, replicas) array
+def sweep_array(densities: list, replicas: int, master=0, config=PERCOLATION, workers=None, chunk=CHUNK):
+    results = np.zeros((len(densities), replicas))
+    for i, r, perc in sweep(densities, replicas, master, config, workers, chunk):
+        results[i, r] = perc
+    return results
@@ -0,0 +1,257 @@
+import json
+import os
+import threading
+import numpy as np
+import forest as ft
+import simulation as sim
+
+# Planes recorded at every step (the water never changes and is recorded once)
+PLANES = ("trees", "burning", "clouds")
+# A step is recorded in full every KEYFRAME_INTERVAL steps, so that replaying a step decodes at most as many deltas
+KEYFRAME_INTERVAL = 50
+# Growth of the data file when it is full (bytes)
+GROWTH = 64 * 1024 * 1024
+
+# Kinds of records
+KEYFRAME = 0
+DELTA = 1
+
+# Run-length encoding of bytes: (lengths of the runs, value of the runs)
+def rle_encode(data) -> tuple:
+    starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(data))).astype('uint32')
+    return lengths, data[starts]
+
+def rle_decode(lengths, values):
+    return np.repeat(values, lengths)
+
+# Records the states of a forest step after step in a directory:
+# - data.bin: memory-mapped records, a keyframe (the packed planes) or a delta (run-length encoded XOR
+#   with the previous step) when it is smaller
+# - index.npy: (offset, size, kind) of every record, counters.npy: counters of every record,
+#   steps.npy: step of the forest of every record (steps may be skipped between two records)
+# - water.npy and meta.json: water plane, shape and parameters of the forest
+class TrajectoryWriter:
+
+    _path = None
+    _data = None
+    _size = None
+    _index = None
+    _counters = None
+    _steps = None
+    _previous = None
+    _compress = None
+    _keyframe_interval = None
+
+    def __init__(self, path: str, forest, compress=True, keyframe_interval=KEYFRAME_INTERVAL):
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._compress = compress
+        self._keyframe_interval = keyframe_interval
+        self._index = []
+        self._counters = []
+        self._steps = []
+        self._size = 0
+
+        # The data file is mapped with some room ahead, and grows by GROWTH when it is full
+        self._file = open(os.path.join(path, "data.bin"), "w+b")
+        self.reserve(max(GROWTH, 4 * self.pack(forest).nbytes))
+
+        np.save(os.path.join(path, "water.npy"), forest._water._gridbis)
+        with open(os.path.join(path, "meta.json"), "w") as meta:
+            json.dump({"shape": list(forest._config.shape), "planes": PLANES, "config": vars(forest._config)}, meta)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Planes of the current state of a forest, packed in one block of bytes
+    @staticmethod
+    def pack(forest):
+        return np.stack([getattr(forest, "_" + name)._gridbis for name in PLANES]).ravel()
+
+    def reserve(self, capacity: int):
+        if self._data is not None:
+            self._data.flush()
+            self._data = None
+        self._file.truncate(capacity)
+        self._data = np.memmap(self._file, dtype='uint8', mode='r+', shape=(capacity,))
+
+    def write(self, chunks: tuple) -> int:
+        size = sum(chunk.nbytes for chunk in chunks)
+        if self._size + size > len(self._data):
+            self.reserve(len(self._data) + max(GROWTH, size))
+
+        offset = self._size
+        for chunk in chunks:
+            self._data[self._size:self._size + chunk.nbytes] = chunk.view('uint8').ravel()
+            self._size += chunk.nbytes
+        return offset
+
+    # Records the current state of the forest, reached after the given step (the number of records by default)
+    def append(self, forest, step=None):
+        block = self.pack(forest)
+        kind, chunks = KEYFRAME, (block,)
+
+        if self._compress and self._previous is not None and len(self._index) % self._keyframe_interval != 0:
+            lengths, values = rle_encode(block ^ self._previous)
+            if lengths.nbytes + values.nbytes < block.nbytes:
+                kind, chunks = DELTA, (lengths, values)
+
+        offset = self.write(chunks)
+        self._index.append((offset, self._size - offset, kind))
+        self._counters.append((forest._tree, forest._burnt, forest._empties))
+        self._steps.append(len(self._steps) if step is None else step)
+        self._previous = block
+
+    # Saves the index so that the records written so far can be replayed
+    def flush(self):
+        self._data.flush()
+        np.save(os.path.join(self._path, "index.npy"), np.array(self._index, dtype='int64').reshape(-1, 3))
+        np.save(os.path.join(self._path, "counters.npy"), np.array(self._counters, dtype='int64').reshape(-1, 3))
+        np.save(os.path.join(self._path, "steps.npy"), np.array(self._steps, dtype='int64'))
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._data = None
+        self._file.truncate(self._size)
+        self._file.close()
+        self._file = None
+
+# Random access to the records of a trajectory, numbered from 0 in the order they were written. The data file
+# is memory-mapped, so only the records needed to rebuild a state are read: the previous keyframe and the deltas
+# after it, or a single delta when the records are replayed in order.
+class Trajectory:
+
+    _path = None
+    _data = None
+    _index = None
+    _counters = None
+    _steps = None
+    _keyframes = None
+    _water = None
+    _shape = None
+    _config = None
+    _cache = None
+
+    def __init__(self, path: str):
+        self._path = path
+        with open(os.path.join(path, "meta.json")) as meta:
+            meta = json.load(meta)
+        self._shape = tuple(meta["shape"])
+        config = meta["config"]
+        config["shape"] = tuple(config["shape"])
+        self._config = ft.ForestConfig(**config)
+
+        self._index = np.load(os.path.join(path, "index.npy"))
+        self._keyframes = np.flatnonzero(self._index[:, 2] == KEYFRAME)
+        self._counters = np.load(os.path.join(path, "counters.npy"))
+        self._steps = np.load(os.path.join(path, "steps.npy"))
+        self._water = np.load(os.path.join(path, "water.npy"))
+        self._data = np.memmap(os.path.join(path, "data.bin"), dtype='uint8', mode='r')
+        # Last decoded record and its packed planes
+        self._cache = (None, None)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def record(self, index: int):
+        offset, size, kind = self._index[index]
+        return kind, self._data[offset:offset + size]
+
+    # Packed planes of a record
+    def block(self, index: int):
+        if not 0 <= index < len(self):
+            raise IndexError(f"record {index} not in the trajectory of {len(self)} records")
+
+        # Deltas are applied from the previous keyframe, or from the cached record when it comes after it
+        start = self._keyframes[np.searchsorted(self._keyframes, index, side='right') - 1]
+        cached, block = self._cache
+        if cached is None or not start <= cached <= index:
+            cached, block = start, self.record(start)[1].copy()
+        for i in range(cached + 1, index + 1):
+            record = self.record(i)[1]
+            runs = len(record) // 5
+            block = block ^ rle_decode(record[:4 * runs].view('uint32'), record[4 * runs:])
+
+        self._cache = (index, block)
+        return block
+
+    # Planes (trees, burning, clouds) of a record, indexed [x, y]
+    def planes(self, index: int) -> tuple:
+        return tuple(self.block(index).reshape((len(PLANES),) + self._shape))
+
+    # Counters (trees, burning, empties) of a record
+    def counters(self, index: int) -> tuple:
+        return tuple(self._counters[index])
+
+    # Step of the forest of a record
+    def step(self, index: int) -> int:
+        return int(self._steps[index])
+
+    def snapshot(self, index: int) -> sim.Snapshot:
+        trees, burning, clouds = self.planes(index)
+        return sim.Snapshot.from_planes(trees, burning, self._water, clouds, self.counters(index), self._config,
+                                        self.step(index))
+
+# Plays a recorded trajectory with the interface of a Simulation, so that the scene can display it.
+# The parameters cannot be changed, but the replay can be moved to any record.
+class Replay(threading.Thread):
+
+    _trajectory = None
+    _index = None
+    _snapshot = None
+    _steps_per_second = None
+
+    def __init__(self, trajectory: Trajectory, steps_per_second=None):
+        super().__init__(daemon=True)
+        self._trajectory = trajectory
+        self._steps_per_second = steps_per_second
+        self._index = 0
+        self._snapshot = trajectory.snapshot(0)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self._trajectory)
+
+    # Parameters are those of the recorded run
+    def set(self, **parameters):
+        pass
+
+    def snapshot(self) -> sim.Snapshot:
+        with self._lock:
+            return self._snapshot
+
+    def stop(self):
+        self._stopped.set()
+
+    # Step of the forest of the last record
+    def last_step(self) -> int:
+        return self._trajectory.step(len(self) - 1)
+
+    # Moves the replay to a record (clamped to the records)
+    def seek(self, index: int):
+        with self._lock:
+            self._index = min(max(index, 0), len(self) - 1)
+            self._snapshot = self._trajectory.snapshot(self._index)
+
+    # Moves the replay by a number of records (backwards when negative)
+    def move(self, records: int):
+        self.seek(self._index + records)
+
+    def step(self):
+        self.move(1)
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.step()
+            # The last record stays on screen until the replay is moved back
+            self._stopped.wait(1 / self._steps_per_second if self._steps_per_second else 0)